@@ -0,0 +1,157 @@
+'''
+Benchmarks of the capture and DSP pipeline on the simulated device
+each run is added to benchmark_results.jsonl and compared with the last run on the same machine
+'''
+
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import numpy
+from sdr_programme import load_programme, programme_path
+from sdr_sim import SimulatedRtlSdr
+from sdr_results import ResultWriter, TextSink, CsvSink, BinarySink
+
+# FFT sizes to time
+sizes = [1024, 5000, 16384, 65536]
+
+# averages taken by each data() call
+num_avg = 100
+
+# capture modes of data() to time
+modes = ['batch', 'welch', 'stream', 'loop']
+
+# timed runs of each benchmark, the median is reported
+repeats = 20
+
+# file the results of every run are added to
+results_path = 'benchmark_results.jsonl'
+
+# Function to time a call, returns the median and fastest times in seconds
+def time_call(function, runs):
+
+    times = []
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        # first call builds the plans and buffers, as the first cycle of a run would
+        function()
+
+        for x in range(runs):
+            start = time.perf_counter()
+            function()
+            times.append(time.perf_counter() - start)
+
+    return float(numpy.median(times)), min(times)
+
+# Function to make one result entry, items is the number of samples or rows handled per call
+def result(benchmark, size, mode, median, fastest, items):
+
+    return {'benchmark': benchmark, 'size': size, 'mode': mode, 'median_ms': 1000 * median, 'min_ms': 1000 * fastest, 'per_second': items / median}
+
+# Function to run every benchmark and return the list of results
+def run(programme):
+
+    sdr = SimulatedRtlSdr(repeat=2**20, seed=1)
+    sdr.center_freq = 71.1e6
+    freq_mhz = 71.0
+
+    results = []
+
+    for num_samples in sizes:
+
+        # single block read and FFT
+        median, fastest = time_call(lambda: programme.fft(sdr, num_samples), repeats)
+        results.append(result('fft', num_samples, '', median, fastest, num_samples))
+
+        # full capture of every average in each mode, fewer runs as these are long
+        for mode in modes:
+            median, fastest = time_call(lambda: programme.data(sdr, num_avg, num_samples, mode), max(3, repeats // 4))
+            results.append(result('data', num_samples, mode, median, fastest, num_avg * num_samples))
+
+        # peak detection on an averaged spectrum
+        with contextlib.redirect_stdout(io.StringIO()):
+            spectrum, faxis, spectrum_last = programme.data(sdr, num_avg, num_samples)
+
+        for detector in ['threshold', 'cfar']:
+            median, fastest = time_call(lambda: programme.peak_det(spectrum, faxis, freq_mhz, detector), repeats)
+            results.append(result('peak_det', num_samples, detector, median, fastest, num_samples))
+
+    # writing one result to the buffered logs
+    with tempfile.TemporaryDirectory() as directory:
+        writer = ResultWriter([TextSink(os.path.join(directory, 'log.txt')), CsvSink(os.path.join(directory, 'log.csv')), BinarySink(os.path.join(directory, 'log.bin'))])
+        row = ['18/10/26', '12:00:00', -20.0, 71.0, -35.0, 70.98, -40.0, 71.06, -45.0, 71.1, -60.0, 'noise', -1.5, 53.4, 120.0]
+
+        median, fastest = time_call(lambda: programme.display_write(writer, *row), repeats * 10)
+        results.append(result('display_write', 1, '', median, fastest, 1))
+
+        writer.close()
+
+    return results
+
+# Function to find the version of the code being timed
+def version():
+
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'], cwd=os.path.dirname(programme_path), stderr=subprocess.DEVNULL).decode().strip()
+    except:
+        return 'unknown'
+
+# Function to load the most recent stored run from this machine, or None
+def last_run(path, machine):
+
+    last = None
+
+    try:
+        with open(path, 'r') as f:
+            for line in f:
+                run_entry = json.loads(line)
+                if run_entry['machine'] == machine:
+                    last = run_entry
+    except (OSError, ValueError):
+        pass
+
+    return last
+
+# Function to print the results next to the change since the last run
+def report(run_entry, previous):
+
+    before = dict()
+    if previous is not None:
+        before = dict(((entry['benchmark'], entry['size'], entry['mode']), entry['median_ms']) for entry in previous['results'])
+
+    print('Version %s on %s, numpy %s\n' % (run_entry['version'], run_entry['machine'], run_entry['numpy']))
+
+    for entry in run_entry['results']:
+        key = (entry['benchmark'], entry['size'], entry['mode'])
+
+        change = ''
+        if key in before:
+            change = ', %+.1f%% vs %s' % (100 * (entry['median_ms'] / before[key] - 1), previous['version'])
+
+        print('%-14s %6d %-10s median %9.3f ms, min %9.3f ms, %12.0f per second%s' % (entry['benchmark'], entry['size'], entry['mode'], entry['median_ms'], entry['min_ms'], entry['per_second'], change))
+
+    return
+
+if __name__ == '__main__':
+
+    programme = load_programme()
+
+    run_entry = {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'version': version(),
+        'machine': platform.node(),
+        'platform': platform.platform(),
+        'numpy': numpy.__version__,
+        'results': run(programme),
+    }
+
+    previous = last_run(results_path, run_entry['machine'])
+
+    report(run_entry, previous)
+
+    with open(results_path, 'a') as f:
+        f.write(json.dumps(run_entry) + '\n')
@@ -0,0 +1,84 @@
+'''
+Running the measurement cycle on a fixed period rather than sleeping a fixed time between cycles
+'''
+
+import collections
+import time
+
+# Function to sleep until a given time, returns at once if it has passed
+def sleep_until(deadline):
+
+    remaining = deadline - time.time()
+
+    if remaining > 0:
+        time.sleep(remaining)
+
+    return
+
+# Class starting each cycle on a fixed grid of start times and keeping track of how well the grid is held
+class CycleScheduler:
+
+    def __init__(self, period=10.0, report_every=10, history=1000):
+
+        self.period = period
+        self.report_every = report_every
+
+        # start time of the next cycle, which is also the deadline of the current one
+        self.next_start = None
+        self.started = None
+
+        self.cycles = 0
+        self.missed = 0
+
+        # recent start delays and cycle durations in seconds
+        self.lateness = collections.deque(maxlen=history)
+        self.durations = collections.deque(maxlen=history)
+
+    # Function to wait for the start of the next cycle
+    def wait(self):
+
+        now = time.time()
+
+        if self.next_start is None:
+            self.next_start = now
+
+        # the last cycle ran past its deadline, start on the next free slot so the period is kept
+        elif now > self.next_start:
+            overrun = now - self.next_start
+            self.missed += 1
+            self.next_start += (int(overrun // self.period) + 1) * self.period
+
+            print('Cycle Missed its Deadline by %.2f s\n' % overrun)
+
+        sleep_until(self.next_start)
+
+        self.started = time.time()
+        self.lateness.append(self.started - self.next_start)
+        self.next_start += self.period
+
+        return
+
+    # Function to mark the end of a cycle and print a summary every few cycles
+    def done(self):
+
+        self.durations.append(time.time() - self.started)
+        self.cycles += 1
+
+        if self.report_every and self.cycles % self.report_every == 0:
+            print(self.summary())
+
+        return
+
+    # Function to describe the timing of recent cycles
+    def summary(self):
+
+        lateness = sorted(self.lateness)
+        durations = list(self.durations)
+
+        if not durations:
+            return 'No Cycles Completed\n'
+
+        return 'Cycles: %d, Missed Deadlines: %d, Start Jitter: mean %.1f ms, 95%% %.1f ms, max %.1f ms, Cycle Time: mean %.2f s, max %.2f s of %.2f s\n' % (
+            self.cycles, self.missed,
+            1000 * sum(lateness) / len(lateness), 1000 * lateness[int(0.95 * (len(lateness) - 1))], 1000 * lateness[-1],
+            sum(durations) / len(durations), max(durations), self.period)
@@ -0,0 +1,163 @@
+'''
+Background reading of the GPS so captures never wait on gpsd
+'''
+
+import calendar
+import threading
+import time
+
+try:
+    import gpsd
+
+except:
+    print("gpsd Not Available on This Device\n")
+
+# Class polling gpsd on its own thread and keeping a short history of fixes
+# the history is a tuple that is replaced rather than changed, so readers need no lock
+class GpsService(threading.Thread):
+
+    def __init__(self, period=1.0, history_length=30, max_extrapolate=2.0):
+
+        threading.Thread.__init__(self)
+        self.daemon = True
+
+        self.period = period
+        self.history_length = history_length
+        # furthest a position is projected past the newest fix, in seconds
+        self.max_extrapolate = max_extrapolate
+
+        # (time received, lon, lat, alt, mode, time of fix) of recent fixes, oldest first
+        # positions are found by the time received, on the same clock as the captures, as the Pi's clock may not agree with GPS time
+        self.history = ()
+        self.running = True
+
+    def run(self):
+
+        connected = False
+        reported = False
+
+        while self.running:
+
+            try:
+                if not connected:
+                    # Connect to the local gpsd
+                    gpsd.connect()
+                    connected = True
+
+                # Get gps position
+                location = gpsd.get_current()
+
+                fix = read_fix(location)
+                reported = False
+
+                # gpsd repeats its last report until a new fix arrives, only keep fixes made after the last
+                # replace the history in one assignment so readers always see a complete tuple
+                if not self.history or fix[5] > self.history[-1][5]:
+                    self.history = self.history[-(self.history_length - 1):] + (fix,)
+
+            # if unable to connect, alert user once and try again later
+            except:
+                if not reported:
+                    print('GPS Not Available\n')
+                    reported = True
+
+                connected = False
+
+            time.sleep(self.period)
+
+        return
+
+    # Function to stop the service
+    def stop(self):
+
+        self.running = False
+
+        return
+
+    # Function to return the newest fix as (lon, lat, alt, mode, age in seconds since it was received)
+    def latest(self):
+
+        history = self.history
+
+        if not history:
+            return 0, 0, 0, 0, float('inf')
+
+        received, lon, lat, alt, mode, gps_time = history[-1]
+
+        return lon, lat, alt, mode, time.time() - received
+
+    # Function to return the newest position, 0 for anything not known
+    def position(self):
+
+        lon, lat, alt, mode, age = self.latest()
+
+        return lon, lat, alt
+
+    # Function to estimate the position at a given time.time() from the fixes received either side of it
+    def position_at(self, when):
+
+        # only fixes with at least a 2D lock have a position
+        fixes = [fix for fix in self.history if fix[4] >= 2]
+
+        if not fixes:
+            return 0, 0, 0
+
+        # before the history starts use the oldest fix, with one fix there is nothing to interpolate
+        if when <= fixes[0][0]:
+            return fixes[0][1:4]
+
+        if len(fixes) == 1:
+            return fixes[0][1:4]
+
+        # pair of fixes to interpolate between, or the last two to extrapolate from
+        after = len(fixes) - 1
+        for x in range(1, len(fixes)):
+            if fixes[x][0] >= when:
+                after = x
+                break
+
+        before_fix = fixes[after - 1]
+        after_fix = fixes[after]
+
+        when = min(when, after_fix[0] + self.max_extrapolate)
+        fraction = (when - before_fix[0]) / (after_fix[0] - before_fix[0])
+
+        lon = before_fix[1] + fraction * (after_fix[1] - before_fix[1])
+        lat = before_fix[2] + fraction * (after_fix[2] - before_fix[2])
+
+        # altitude is only known with a 3D lock
+        if before_fix[4] >= 3 and after_fix[4] >= 3:
+            alt = before_fix[3] + fraction * (after_fix[3] - before_fix[3])
+        else:
+            alt = after_fix[3]
+
+        return lon, lat, alt
+
+# Function to turn a gpsd report in to a fix tuple, timed by when it was received and by the GPS
+def read_fix(location):
+
+    # If at least 2D fix (mode 2 or 3) is achieved, save longitude and latitude
+    if location.mode >= 2:
+        lon = location.lon
+        lat = location.lat
+    else:
+        lon = 0
+        lat = 0
+
+    # If at 3D fix (mode 3) is achieved, save altitude
+    if location.mode >= 3:
+        alt = location.alt
+    else:
+        alt = 0
+
+    return time.time(), lon, lat, alt, location.mode, fix_time(location)
+
+# Function to read the time of a gpsd report, the UTC time the fix was made, or the time now if the report has none
+def fix_time(location):
+
+    try:
+        text = location.time
+        return calendar.timegm(time.strptime(text[:19], '%Y-%m-%dT%H:%M:%S')) + float('0' + text[19:].rstrip('Z'))
+
+    except:
+        return time.time()
@@ -2,6 +2,9 @@
 import numpy
 import matplotlib.pyplot as plt
 import glob
+import datetime
+from sdr_dsp import get_plan
+from sdr_storage import list_archives, open_archive
 
 samples = dict()
 names = dict()
@@ -58,17 +61,18 @@ for index in samples:
     sample_rate = float(sample_rate_str[index])
     center_freq = float(center_freq_str[index])
 
-    # create frequency axis, noting that Fc is in centre
-    fstep = sample_rate/array_length # fft bin size
-       
-    faxis[index] = []
-    k = 0
-    while k < array_length:
-        faxis[index].append(((center_freq)-(fstep*(array_length/2))) + k * fstep)
-        k = k + 1
+    # frequency axis with Fc in the centre, shared between files of the same band
+    faxis[index] = get_plan(array_length, sample_rate*1000000, center_freq*1000000, None).faxis
 
 print ("FFT Ready\n")
 
+# open the spectrum archives, each is mapped from disk rather than read in to memory
+archives = dict()
+
+for name in list_archives('C:/Users\elp15dw\Google Drive\Tests\Test 15.06.17'):
+    archives[name] = open_archive(name)
+    print("%s: %d Spectra" % (name, len(archives[name][1])))
+
 for index in spectrums:
     plt.figure()
     plt.plot(faxis[index],spectrums[index].real)
@@ -77,6 +81,27 @@ for index in spectrums:
     plt.title(titles[index])
     plt.grid()
 
+# plot each archive as a waterfall, only reading every step'th row from disk
+for name in archives:
+    archive_spectra, archive_index = archives[name]
+
+    if len(archive_index) == 0:
+        continue
+
+    step = max(1, len(archive_index) // 1000)
+
+    first = archive_index[0]
+    archive_faxis = get_plan(archive_spectra.shape[1], first['sample_rate'], first['center_freq'], None).faxis
+    start = datetime.datetime.fromtimestamp(archive_index['time'][0])
+    end = datetime.datetime.fromtimestamp(archive_index['time'][-1])
+
+    plt.figure()
+    plt.imshow(archive_spectra[::step], aspect='auto', extent=[archive_faxis[0], archive_faxis[-1], len(archive_index), 0])
+    plt.colorbar(label='Relative Power (dB)')
+    plt.xlabel('Frequency (MHz)')
+    plt.ylabel('Capture')
+    plt.title('%s to %s' % (start.strftime('%d.%m.%y %H:%M:%S'), end.strftime('%H:%M:%S')))
+
 
 
 plt.show()
\ No newline at end of file
@@ -7,22 +7,11 @@ Created on 7 Jun 2018
 import numpy
 import matplotlib.pyplot as plt
 import glob
-import csv
-from math import radians, sin, cos, sqrt, asin
-
-def haversine(lat1, lon1, lat2, lon2):
- 
-    R = 6372.8 # Earth radius in kilometers
-     
-    dLat = radians(lat2 - lat1)
-    dLon = radians(lon2 - lon1)
-    lat1 = radians(lat1)
-    lat2 = radians(lat2)
-     
-    a = sin(dLat/2)**2 + cos(lat1)*cos(lat2)*sin(dLon/2)**2
-    c = 2*asin(sqrt(a))
-     
-    return R * c *1000
+import os
+import log_query
+from replay import band_freq
+from sdr_dsp import get_plan
+from sdr_storage import CaptureIndex, open_archive
 
 snr_level = 5
 
@@ -32,100 +21,97 @@ peak_search_range = 0.05
 origin_lat = 53.380834
 origin_lon = -1.478466
 
-data = []
+#open csv file and load results in to columns
+log = log_query.load_log('C:/Users\elp15dw\Google Drive\Tests\Test 08.05.18\log.csv')
 
-#open csv file and load results
-with open('C:/Users\elp15dw\Google Drive\Tests\Test 08.05.18\log.csv', 'r') as csvfile:
-    reader = csv.reader(csvfile, delimiter=',', quotechar='|')
-    for row in reader:
-           
-        data.append(row[0:14]) 
-        
-        
-csvfile.close()
+#search for required data 
+selected = log[log_query.snr_range(log, 5, 10) & log_query.distance_range(log, origin_lat, origin_lon, 200)]
+
+# separate data in to useful variables
+peak_1_amp = selected['amp'][:, 0]
+peak_2_amp = selected['amp'][:, 1]
+peak_3_amp = selected['amp'][:, 2]
+peak_4_amp = selected['amp'][:, 3]
+noise_amp = selected['amp'][:, 4]
 
+peak_1_freq = selected['freq'][:, 0]
+peak_2_freq = selected['freq'][:, 1]
+peak_3_freq = selected['freq'][:, 2]
+peak_4_freq = selected['freq'][:, 3]
 
+snr = log_query.snr(selected)
+dist = log_query.distance(selected, origin_lat, origin_lon)
 
-time = []
-date = []
-peak_1_amp = []
-peak_2_amp = []
-peak_3_amp = []
-peak_4_amp = []
-noise_amp = []
-peak_1_freq = []
-peak_2_freq = []
-peak_3_freq = []
-peak_4_freq = []
 file_name = []
-snr = []
-lat = []
-lon = []
-dist = []
+log_time = []
 
-# separate data in to useful variables
-for line in data:
+for date, time, freq in zip(selected['date'].astype(str), selected['hour'].astype(str), peak_1_freq):
     
-    date = line[0]
     day = date[0:2]
     month = date[3:5]
     year = date[8:10]
     
-         
-    time = line[1]
     hour = time[0:2]
     minute = time[3:5]
     sec = time[6:8]
     
+    file_name.append('C:/Users\elp15dw\Google Drive\Tests\Test ' + day + '.' + month + '.'  + year + '\\' + '*' + month + '_' + day + '_'  + year + '-' + hour + '_' + minute  + '_' + sec + '*.npy')
     
-    sig = float(line[2]) - 144
-    noise = float(line[10]) - 144
-    
-    lat = float(line[13])
-    lon = float(line[12])
+    # keep the logged time and band to look the capture up in the index
+    log_time.append((date, time, freq))
         
-    curr_snr = sig - noise
+
+titles = []
+sample_rate_str = []
+center_freq_str = []
+samples = []
+
+# tuning in Hz of each capture found in an index, None for captures found by searching the directory
+tunings = []
+
+# capture indexes and archives, opened once per test directory
+indexes = dict()
+archives = dict()
+
+#load .npy files for required dta
+for name, (log_date, log_hour, log_freq) in zip(file_name, log_time):
     
-    x = 0 
-   
-    if lon == 0:
-        
-        curr_dist = 0
-        
-    else:
-        curr_dist = haversine(origin_lat, origin_lon, lat, lon)
+    # look the capture up in the index of its test directory if there is one
+    directory = name.rsplit('\\', 1)[0]
     
-
+    if directory not in indexes:
+        indexes[directory] = None
+        if os.path.exists(directory + '\\captures.db'):
+            indexes[directory] = CaptureIndex(directory + '\\captures.db')
     
-    #search for required data 
-    if  curr_snr > 5 and curr_snr < 10 and curr_dist > 200:
-            
-        peak_1_amp.append(float(line[2]))
-        peak_2_amp.append(float(line[4]))
-        peak_3_amp.append(float(line[6]))
-        peak_4_amp.append(float(line[8]))
-        noise_amp.append(float(line[10]))
+    found = None
+    if indexes[directory] is not None:
+        found = indexes[directory].find(log_date, log_hour, log_freq)
     
-        peak_1_freq.append(float(line[3]))
-        peak_2_freq.append(float(line[5]))
-        peak_3_freq.append(float(line[7]))
-        peak_4_freq.append(float(line[9]))
+    if found is not None:
+        archive, row, iq = found
         
-        snr.append(curr_snr)
+        if archive not in archives:
+            archives[archive] = open_archive(archive)
         
-        dist.append(curr_dist)        
+        archive_spectra, archive_index = archives[archive]
         
-        file_name.append('C:/Users\elp15dw\Google Drive\Tests\Test ' + day + '.' + month + '.'  + year + '\\' + '*' + month + '_' + day + '_'  + year + '-' + hour + '_' + minute  + '_' + sec + '*.npy')
+        print('%s row %d' % (archive, row))
         
-
-titles = []
-sample_rate_str = []
-center_freq_str = []
-samples = []
-
-#load .npy files for required dta
-for name in file_name:
+        # tuning from the archive index, zoomed and swept archives are labelled so their names do not hold the band
+        center_freq = archive_index[row]['center_freq']
+        sample_rate = archive_index[row]['sample_rate']
+        
+        titles.append(log_date.replace('/','.') + ' ' + log_hour + ' ' + '%.1fMHz' % band_freq(center_freq, sample_rate))
+        sample_rate_str.append('%.4f' % (sample_rate/1000000))
+        center_freq_str.append('%.4f' % (center_freq/1000000))
+        tunings.append((center_freq, sample_rate))
         
+        samples.append(archive_spectra[row])
+        
+        continue
+    
+    # captures saved before the index was kept are found by searching the directory
     curr_file = glob.glob(name)
     
     print(curr_file[0])
@@ -149,6 +135,8 @@ for name in file_name:
     #retrieve centre frequency
     center_freq_str.append(info[2][:-3])
     
+    tunings.append(None)
+    
     samples.append(numpy.load(curr_file[0]))
     
 num_samples = len(samples)
@@ -157,12 +145,24 @@ print("\n%d Sample Files Loaded\n" % num_samples)
 
 faxis = []
 
+# band of each capture in MHz, the centre of the peak search limits
+band_centres = []
+
 x = 0 
 
 #reconstruct frequency axis
 for index in samples: 
          
     array_length = len(index)
+    
+    # captures from an index are placed from the tuning stored with them
+    if tunings[x] is not None:
+        center_freq, sample_rate = tunings[x]
+        faxis.append(get_plan(array_length, sample_rate, center_freq, None).faxis)
+        band_centres.append(band_freq(center_freq, sample_rate))
+        
+        x = x + 1
+        continue
  
     sample_rate = float(sample_rate_str[x])
     center_freq = float(center_freq_str[x])
@@ -176,17 +176,9 @@ for index in samples:
     else:
         center_freq = center_freq + 0.1
  
-    # create frequency axis, noting that Fc is in centre
-    fstep = sample_rate/array_length # fft bin size
-        
-    curr_faxis = []
-    
-    k = 0
-    while k < array_length:
-        curr_faxis.append(((center_freq)-(fstep*(array_length/2))) + k * fstep)
-        k = k + 1
-        
-    faxis.append(curr_faxis)
+    # frequency axis with Fc in the centre, shared between files of the same band
+    faxis.append(get_plan(array_length, sample_rate*1000000, center_freq*1000000, None).faxis)
+    band_centres.append(faxis[x][array_length // 2] - freq_offset)
     
     x = x + 1
  
@@ -207,7 +199,7 @@ for index in samples:
     plt.plot(peak_4_freq[x], peak_4_amp[x]-144, 'go')
     
     #plot estimated noise
-    plt.plot([faxis[x][0],faxis[x][4999]],[(noise_amp[x]-144),(noise_amp[x]-144)], 'r--',linewidth=5, label = 'Estimated Noise Level')
+    plt.plot([faxis[x][0],faxis[x][-1]],[(noise_amp[x]-144),(noise_amp[x]-144)], 'r--',linewidth=5, label = 'Estimated Noise Level')
     
     # annotate plot with highest peak
     plt.annotate('recorded Peak Power \n %.1f dBm \n %.3f MHz'%((peak_1_amp[x]-144), peak_1_freq[x]),
@@ -217,14 +209,14 @@ for index in samples:
         
     # annotate plot with noise value    
     plt.annotate('Recorded Estimated Noise: \n %.1f dBm \n Recorded SNR: \n %.1f dBm \n Recorded Distance From TX: \n %.1f m' %((noise_amp[x]-144), snr[x], dist[x]),
-        xy=(faxis[x][2500], (noise_amp[x]-144)), xycoords='data',
+        xy=(band_centres[x], (noise_amp[x]-144)), xycoords='data',
         xytext=(0.15, 0.5), textcoords='figure fraction')
 
     
     axes = plt.gca()
     ymin, ymax = axes.get_ylim()
-    plt.plot([(faxis[x][2500]-peak_search_range-freq_offset),(faxis[x][2500]-peak_search_range-freq_offset)],[ymax,ymin], 'k:',linewidth=2.5, label = 'Peak search Limits')
-    plt.plot([(faxis[x][2500]+peak_search_range-freq_offset),(faxis[x][2500]+peak_search_range-freq_offset)],[ymax,ymin], 'k:',linewidth=2.5)
+    plt.plot([(band_centres[x]-peak_search_range),(band_centres[x]-peak_search_range)],[ymax,ymin], 'k:',linewidth=2.5, label = 'Peak search Limits')
+    plt.plot([(band_centres[x]+peak_search_range),(band_centres[x]+peak_search_range)],[ymax,ymin], 'k:',linewidth=2.5)
     
     plt.xlabel('Frequency (MHz)')
     plt.ylabel('Relative Power (dB)')
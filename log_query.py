@@ -0,0 +1,212 @@
+'''
+Loading of log.csv in to typed columns and vectorised filtering of the results
+'''
+
+import os
+import numpy
+
+# one row of log.csv, the 'noise' label column is skipped
+log_dtype = numpy.dtype([('date', 'S10'), ('hour', 'S8'), ('amp', 'f8', 5), ('freq', 'f8', 4), ('lon', 'f8'), ('lat', 'f8'), ('alt', 'f8')])
+
+# columns of log.csv in the order of log_dtype
+log_columns = (0, 1, 2, 4, 6, 8, 10, 3, 5, 7, 9, 12, 13, 14)
+
+# Function to load log.csv, or a list of its lines, in to a structured array
+def load_log(path):
+
+    flat_dtype = numpy.dtype([('date', 'S10'), ('hour', 'S8')] + [('c%d' % x, 'f8') for x in range(12)])
+    flat = numpy.loadtxt(path, delimiter=',', dtype=flat_dtype, usecols=log_columns, ndmin=1)
+
+    log = numpy.zeros(len(flat), dtype=log_dtype)
+    log['date'] = flat['date']
+    log['hour'] = flat['hour']
+    log['amp'] = numpy.column_stack([flat['c%d' % x] for x in range(5)])
+    log['freq'] = numpy.column_stack([flat['c%d' % x] for x in range(5, 9)])
+    log['lon'] = flat['c9']
+    log['lat'] = flat['c10']
+    log['alt'] = flat['c11']
+
+    return log
+
+# Function to convert the date and hour columns to seconds since 1970 on the logging device's clock
+# dates are dd/mm/yy or dd/mm/yyyy and hours HH:MM:SS
+def log_time(log):
+
+    # read the digits straight from the text
+    date = numpy.ascontiguousarray(log['date']).view(numpy.uint8).reshape(len(log), 10).astype(numpy.int64) - ord('0')
+    hour = numpy.ascontiguousarray(log['hour']).view(numpy.uint8).reshape(len(log), 8).astype(numpy.int64) - ord('0')
+
+    day = date[:, 0] * 10 + date[:, 1]
+    month = date[:, 3] * 10 + date[:, 4]
+
+    # unused bytes of short dates are zero, which reads as a negative digit
+    long_year = date[:, 8] >= 0
+    year = numpy.where(long_year, date[:, 6] * 1000 + date[:, 7] * 100 + date[:, 8] * 10 + date[:, 9], 2000 + date[:, 6] * 10 + date[:, 7])
+
+    # whole months since 1970, then days and seconds within the month
+    months = ((year - 1970) * 12 + month - 1).astype('datetime64[M]')
+    days = months.astype('datetime64[D]') + (day - 1)
+    seconds = (hour[:, 0] * 10 + hour[:, 1]) * 3600 + (hour[:, 3] * 10 + hour[:, 4]) * 60 + hour[:, 6] * 10 + hour[:, 7]
+
+    return days.astype('datetime64[s]').astype(numpy.int64) + seconds
+
+# Function to find the signal to noise ratio of the measured peak of every row
+def snr(log):
+
+    return log['amp'][:, 0] - log['amp'][:, 4]
+
+# Function to find the distance in metres of every row from an origin, rows without a location are given 0
+def distance(log, origin_lat, origin_lon):
+
+    R = 6372.8 # Earth radius in kilometers
+
+    lat1 = numpy.radians(origin_lat)
+    lat2 = numpy.radians(log['lat'])
+    dLat = lat2 - lat1
+    dLon = numpy.radians(log['lon'] - origin_lon)
+
+    a = numpy.sin(dLat/2)**2 + numpy.cos(lat1)*numpy.cos(lat2)*numpy.sin(dLon/2)**2
+    c = 2*numpy.arcsin(numpy.sqrt(a))
+
+    return numpy.where(log['lon'] == 0, 0, R * c * 1000)
+
+# Functions returning a mask of the rows that pass a filter, combine them with & and |
+# limits left as None are not applied
+
+def snr_range(log, low=None, high=None):
+
+    return within(snr(log), low, high)
+
+def distance_range(log, origin_lat, origin_lon, low=None, high=None):
+
+    return within(distance(log, origin_lat, origin_lon), low, high)
+
+def band(log, freq_mhz, width=1.0):
+
+    return numpy.abs(log['freq'][:, 0] - freq_mhz) < width
+
+def time_window(log, start_time=None, end_time=None):
+
+    return within(log_time(log), start_time, end_time)
+
+# Function to check values lie strictly between two limits
+def within(values, low=None, high=None):
+
+    mask = numpy.ones(len(values), dtype=bool)
+
+    if low is not None:
+        mask &= values > low
+
+    if high is not None:
+        mask &= values < high
+
+    return mask
+
+# Class reading only the rows added to log.csv since it last looked, keeping rolling statistics per band in bounded memory
+class LogTail:
+
+    def __init__(self, path, bands=(71.0, 869.525), window=1000):
+
+        self.path = path
+        self.bands = list(bands)
+        self.window = window
+
+        # position in the file and any line not yet finished by the writer
+        self.offset = 0
+        self.partial = b''
+
+        # most recent rows of each band, kept in a ring
+        self.recent_rows = dict((band, numpy.zeros(window, dtype=log_dtype)) for band in self.bands)
+        self.count = dict((band, 0) for band in self.bands)
+
+        # statistics over every row seen
+        self.total = dict((band, numpy.zeros(5)) for band in self.bands)
+        self.low = dict((band, numpy.full(5, numpy.inf)) for band in self.bands)
+        self.high = dict((band, numpy.full(5, -numpy.inf)) for band in self.bands)
+
+    # Function to read rows added since the last call, returns them as a structured array
+    def poll(self):
+
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return numpy.zeros(0, dtype=log_dtype)
+
+        # start again if the log has been replaced or cut short
+        if size < self.offset:
+            self.offset = 0
+            self.partial = b''
+
+        if size == self.offset:
+            return numpy.zeros(0, dtype=log_dtype)
+
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            new = self.partial + f.read(size - self.offset)
+
+        self.offset = size
+
+        # keep an unfinished last line until the rest of it is written
+        end = new.rfind(b'\n') + 1
+        self.partial = new[end:]
+        lines = new[:end].decode().splitlines()
+
+        if not lines:
+            return numpy.zeros(0, dtype=log_dtype)
+
+        rows = load_log(lines)
+
+        # each row belongs to the band nearest its measured frequency
+        bands = numpy.array(self.bands)
+        nearest = numpy.argmin(numpy.abs(rows['freq'][:, :1] - bands), axis=1)
+
+        for number, band in enumerate(self.bands):
+            self.add(band, rows[nearest == number])
+
+        return rows
+
+    # Function to add new rows of one band to its ring and statistics
+    def add(self, band, rows):
+
+        if len(rows) == 0:
+            return
+
+        self.total[band] += rows['amp'].sum(axis=0)
+        self.low[band] = numpy.minimum(self.low[band], rows['amp'].min(axis=0))
+        self.high[band] = numpy.maximum(self.high[band], rows['amp'].max(axis=0))
+
+        # only the last window rows can end up in the ring
+        kept = rows[-self.window:]
+        position = (self.count[band] + len(rows) - len(kept) + numpy.arange(len(kept))) % self.window
+        self.recent_rows[band][position] = kept
+        self.count[band] += len(rows)
+
+        return
+
+    # Function to return the rows of a band held in the ring, oldest first
+    def recent(self, band):
+
+        count = self.count[band]
+
+        if count < self.window:
+            return self.recent_rows[band][:count]
+
+        return numpy.roll(self.recent_rows[band], -(count % self.window))
+
+    # Function to summarise a band, amplitudes are peaks 1-4 then noise
+    # min, max and mean cover every row seen, percentiles cover the rows in the ring
+    def stats(self, band, percentiles=(5, 50, 95)):
+
+        recent = self.recent(band)['amp']
+
+        summary = {
+            'count': self.count[band],
+            'min': self.low[band],
+            'max': self.high[band],
+            'mean': self.total[band] / max(self.count[band], 1),
+        }
+
+        for percent in percentiles:
+            summary['p%d' % percent] = numpy.percentile(recent, percent, axis=0) if len(recent) else numpy.full(5, numpy.nan)
+
+        return summary
@@ -0,0 +1,275 @@
+'''
+Replay of recorded captures through the programme's own processing and logging, as fast as the computer allows
+run as: python replay.py [directory] [--iq]
+'''
+
+import calendar
+import contextlib
+import io
+import os
+import sys
+import time
+import numpy
+import log_query
+from sdr_dsp import get_plan, get_zoom_plan, peak_det_batch, strongest_first, welch_step
+from sdr_programme import load_programme
+from sdr_results import ResultWriter, TextSink, CsvSink, BinarySink
+from sdr_sim import RecordedRtlSdr
+from sdr_storage import CaptureIndex, list_archives, list_recordings, open_archive
+
+# replay raw I/Q recordings rather than archived spectra
+replay_iq = False
+
+# settings used to process raw I/Q recordings made without their settings in the metadata, as set for each band in test()
+num_avg = 100
+num_samples = 5000
+mode = 'batch'
+
+# peak detector, 'threshold', 'cfar_ca' or 'cfar_os', and the settings passed to cfar() or None for its defaults
+detector = 'threshold'
+cfar_settings = None
+
+# archived spectra processed together, they are already averaged so only the detector can be changed
+chunk = 1000
+
+# offset of the tuned frequency above the band, as set by sdr_control()
+tuning_offset = 0.1e6
+
+# sample rate of the dongle, archived spectra at any other rate were zoomed or swept and are centred on their band
+dongle_rate = 2.048e6
+
+# print progress after this many captures
+progress_every = 1000
+
+# Function to find the band in MHz of an archived spectrum from the tuning stored with it
+def band_freq(center_freq, sample_rate):
+
+    if sample_rate == dongle_rate:
+        return round((center_freq - tuning_offset) / 1e6, 4)
+
+    return round(center_freq / 1e6, 4)
+
+# Function to tell whether an archive holds stitched sweeps, which have no frequency of interest and are logged apart
+def is_sweep(name):
+
+    return '-sweep-' in os.path.basename(name)
+
+# Function to find the settings a recording was captured with from its metadata, the given settings are used for any not recorded
+# returns the settings passed to data(), the band in MHz and the samples each capture reads
+def recording_settings(sdr, default_avg, default_samples, default_mode='batch'):
+
+    capture = sdr.meta['captures'][0]
+
+    settings = {
+        'num_avg': capture.get('rpi_sdr:num_avg', default_avg),
+        'num_samples': capture.get('rpi_sdr:num_samples', default_samples),
+        'mode': capture.get('rpi_sdr:mode', default_mode),
+        'overlap': capture.get('rpi_sdr:overlap', 0.5),
+        'window': capture.get('rpi_sdr:window', 'hamming'),
+        'zoom': capture.get('rpi_sdr:zoom'),
+        'target_freq': capture.get('rpi_sdr:target_freq'),
+    }
+
+    # a zoomed capture reads enough samples for the decimating filter and is centred on its band
+    if settings['zoom'] is not None:
+        plan = get_zoom_plan(settings['num_samples'], sdr.sample_rate, sdr.center_freq, settings['target_freq'], settings['zoom'])
+        capture_samples = settings['num_avg'] * plan.input_samples
+        freq_mhz = round(settings['target_freq'] / 1e6, 4)
+
+    # welch segments overlap, so a capture reads one segment and a step for each further segment
+    elif settings['mode'] == 'welch':
+        capture_samples = settings['num_samples'] + (settings['num_avg'] - 1) * welch_step(settings['num_samples'], settings['overlap'])
+        freq_mhz = round((sdr.center_freq - tuning_offset) / 1e6, 4)
+
+    else:
+        capture_samples = settings['num_avg'] * settings['num_samples']
+        freq_mhz = round((sdr.center_freq - tuning_offset) / 1e6, 4)
+
+    return settings, freq_mhz, capture_samples
+
+# Function to format a time in the same way as time_date()
+def stamp(when):
+
+    local = time.localtime(when)
+
+    return time.strftime("%d/%m/%y", local), time.strftime("%H:%M:%S", local)
+
+# Function to read the start time of a recording from its metadata
+def recording_time(meta):
+
+    text = meta['captures'][0]['core:datetime']
+
+    return calendar.timegm(time.strptime(text[:19], '%Y-%m-%dT%H:%M:%S')) + float('0' + text[19:-1])
+
+# Function to find the logged time and position of each stored capture from captures.db and log.csv
+# returns dictionaries keyed by (absolute archive name, row) and by absolute recording name, of (date, hour, lon, lat, alt)
+def logged_captures(directory):
+
+    by_row = dict()
+    by_iq = dict()
+
+    if not os.path.exists(os.path.join(directory, 'captures.db')):
+        return by_row, by_iq
+
+    # logged positions of each second, a band in each
+    positions = dict()
+    if os.path.exists(os.path.join(directory, 'log.csv')):
+        log = log_query.load_log(os.path.join(directory, 'log.csv'))
+        for entry in log:
+            positions.setdefault((entry['date'].decode(), entry['hour'].decode()), []).append((entry['freq'][0], entry['lon'], entry['lat'], entry['alt']))
+
+    index = CaptureIndex(os.path.join(directory, 'captures.db'))
+
+    for current_date, current_hour, freq_mhz, archive, row, iq in index.entries():
+
+        # the logged result nearest this band in the same second, if there is one
+        lon, lat, alt = 0, 0, 0
+        logged = positions.get((current_date, current_hour))
+        if logged:
+            freq, lon, lat, alt = min(logged, key=lambda entry: abs(entry[0] - freq_mhz))
+
+        capture = (current_date, current_hour, lon, lat, alt)
+
+        by_row[(os.path.abspath(archive), row)] = capture
+        if iq is not None:
+            by_iq[os.path.abspath(iq)] = capture
+
+    index.close()
+
+    return by_row, by_iq
+
+# Function to replay one raw I/Q recording through data(), peak_det() and display_write(), returns the number of captures
+def replay_recording(programme, results, name, by_iq):
+
+    sdr = RecordedRtlSdr(name)
+    settings, freq_mhz, capture_samples = recording_settings(sdr, num_avg, num_samples, mode)
+
+    # position and time from the recording, used if the capture was not logged
+    lon, lat, alt = sdr.meta['global']['core:geolocation']['coordinates']
+    start_time = recording_time(sdr.meta)
+
+    captures = sdr.num_samples // capture_samples
+
+    for x in range(captures):
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            spectrum, faxis, spectrum_last = programme.data(sdr, settings['num_avg'], settings['num_samples'], settings['mode'], zoom=settings['zoom'], target_freq=settings['target_freq'], overlap=settings['overlap'], window=settings['window'])
+
+        peaks = programme.peak_det(spectrum, faxis, freq_mhz, detector, cfar_settings)
+
+        # a recording of one capture at these settings is the logged capture, otherwise time each capture from the recording
+        logged = by_iq.get(os.path.abspath(name))
+        if logged is not None and captures == 1:
+            current_date, current_hour, lon, lat, alt = logged
+        else:
+            current_date, current_hour = stamp(start_time + (x + 1) * capture_samples / sdr.sample_rate)
+
+        programme.display_write(results, current_date, current_hour, *(peaks[:10] + (lon, lat, alt)))
+
+    sdr.close()
+
+    return captures
+
+# Function to replay the spectra of one archive through peak detection and display_write(), returns the number of spectra
+def replay_archive(programme, results, name, by_row):
+
+    spectra, index = open_archive(name)
+
+    for start in range(0, len(spectra), chunk):
+
+        block = numpy.asarray(spectra[start:start + chunk], dtype=numpy.float64)
+        entries = index[start:start + chunk]
+
+        # spectra in a block normally share one tuning, detect each tuning as one batch
+        tunings = numpy.unique(entries[['center_freq', 'sample_rate']])
+
+        for center_freq, sample_rate in tunings:
+
+            rows = numpy.nonzero((entries['center_freq'] == center_freq) & (entries['sample_rate'] == sample_rate))[0]
+            freq_mhz = band_freq(center_freq, sample_rate)
+            faxis = get_plan(block.shape[1], sample_rate, center_freq).faxis
+
+            # the same detection peak_det() runs, on every spectrum at once, with the strongest peak as peak 1 for sweeps as sweep_test() does
+            amps, freqs, indexes = peak_det_batch(block[rows], faxis, freq_mhz, detector, cfar_settings)
+            if is_sweep(name):
+                amps, freqs = strongest_first(block[rows], faxis, amps, freqs)
+
+            for n, row in enumerate(rows):
+
+                logged = by_row.get((os.path.abspath(name), start + row))
+                if logged is not None:
+                    current_date, current_hour, lon, lat, alt = logged
+                else:
+                    current_date, current_hour = stamp(entries['time'][row])
+                    lon, lat, alt = 0, 0, 0
+
+                programme.display_write(results, current_date, current_hour, amps[n, 0], freqs[n, 0], amps[n, 1], freqs[n, 1], amps[n, 2], freqs[n, 2], amps[n, 3], freqs[n, 3], amps[n, 4], 'noise', lon, lat, alt)
+
+    return len(spectra)
+
+# Function to open logs named prefix in output_directory, replacing those of an earlier replay so each run can be compared with the live logs
+def replay_writer(output_directory, prefix):
+
+    paths = [os.path.join(output_directory, prefix + extension) for extension in ('.txt', '.csv', '.bin')]
+
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+    return ResultWriter([TextSink(paths[0]), CsvSink(paths[1]), BinarySink(paths[2])])
+
+# Function to replay every recording or archive in a directory in to logs in output_directory
+def replay(directory='.', output_directory=None, iq=replay_iq):
+
+    if output_directory is None:
+        output_directory = os.path.join(directory, 'replay')
+
+    if not os.path.exists(output_directory):
+        os.makedirs(output_directory)
+
+    programme = load_programme()
+    by_row, by_iq = logged_captures(directory)
+
+    names = list_recordings(directory) if iq else list_archives(directory)
+
+    results = replay_writer(output_directory, 'log')
+
+    # sweeps are logged apart from the fixed bands, as they are when captured
+    sweep_results = None
+    if not iq and any(is_sweep(name) for name in names):
+        sweep_results = replay_writer(output_directory, 'sweep_log')
+
+    start_time = time.time()
+    total = 0
+    reported = 0
+
+    try:
+        for name in names:
+
+            # results are only printed as progress, as the live display would slow the replay down
+            with contextlib.redirect_stdout(io.StringIO()):
+                if iq:
+                    total += replay_recording(programme, results, name, by_iq)
+                elif is_sweep(name):
+                    total += replay_archive(programme, sweep_results, name, by_row)
+                else:
+                    total += replay_archive(programme, results, name, by_row)
+
+            if total - reported >= progress_every:
+                print('Replayed %d Captures, %.0f per Second' % (total, total / (time.time() - start_time)))
+                reported = total
+
+    finally:
+        results.close()
+        if sweep_results is not None:
+            sweep_results.close()
+
+    print('Replay Complete, %d Captures in %.1f Seconds, Results in %s' % (total, time.time() - start_time, output_directory))
+
+    return total
+
+if __name__ == '__main__':
+
+    arguments = [argument for argument in sys.argv[1:] if not argument.startswith('--')]
+
+    replay(arguments[0] if arguments else '.', iq='--iq' in sys.argv or replay_iq)
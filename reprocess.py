@@ -0,0 +1,200 @@
+'''
+Reprocessing of every stored capture in a directory on all cores, in to one table of results
+run as: python reprocess.py [directory] [--iq]
+'''
+
+import contextlib
+import csv
+import io
+import json
+import multiprocessing
+import os
+import sys
+import time
+import numpy
+from replay import band_freq, is_sweep, recording_settings, recording_time, stamp
+from sdr_dsp import get_plan, peak_det_batch, strongest_first
+from sdr_programme import load_programme
+from sdr_sim import RecordedRtlSdr
+from sdr_storage import archive_length, list_archives, list_recordings, open_archive
+
+# reprocess raw I/Q recordings rather than archived spectra
+reprocess_iq = False
+
+# settings used to process raw I/Q recordings made without their settings in the metadata, as set for each band in test()
+num_avg = 100
+num_samples = 5000
+
+# peak detector, 'threshold', 'cfar_ca' or 'cfar_os', and the settings passed to cfar() or None for its defaults
+detector = 'threshold'
+cfar_settings = None
+
+# archived spectra in each piece of work, and recordings in each piece of work
+chunk = 2000
+recordings_per_chunk = 20
+
+# worker processes, None uses every core
+processes = None
+
+# one row of the output table
+result_dtype = numpy.dtype([('time', 'f8'), ('freq_mhz', 'f8'), ('amp', 'f8', 5), ('freq', 'f8', 4), ('source', 'U100'), ('row', 'i8')])
+
+# main programme in each worker, loaded once per process
+programme = None
+
+# Function run once in each worker process
+def start_worker():
+
+    global programme
+    programme = load_programme()
+
+    return
+
+# Function to detect the peaks of rows start to stop of an archive, run in a worker
+# only the archive name is sent to the worker, which maps the file itself
+def archive_work(name, start, stop):
+
+    spectra, index = open_archive(name)
+
+    spectra = numpy.asarray(spectra[start:stop], dtype=numpy.float64)
+    index = index[start:stop]
+
+    results = numpy.zeros(len(spectra), dtype=result_dtype)
+    results['time'] = index['time']
+    results['source'] = os.path.basename(name)
+    results['row'] = numpy.arange(start, stop)
+
+    # spectra normally share one tuning, detect each tuning as one batch
+    for center_freq, sample_rate in numpy.unique(index[['center_freq', 'sample_rate']]):
+
+        rows = numpy.nonzero((index['center_freq'] == center_freq) & (index['sample_rate'] == sample_rate))[0]
+        freq_mhz = band_freq(center_freq, sample_rate)
+        faxis = get_plan(spectra.shape[1], sample_rate, center_freq).faxis
+
+        amps, freqs, indexes = peak_det_batch(spectra[rows], faxis, freq_mhz, detector, cfar_settings)
+
+        # sweeps have no frequency of interest, peak 1 is their strongest peak as when captured
+        if is_sweep(name):
+            amps, freqs = strongest_first(spectra[rows], faxis, amps, freqs)
+
+        results['freq_mhz'][rows] = freq_mhz
+        results['amp'][rows] = amps
+        results['freq'][rows] = freqs
+
+    return results
+
+# Function to process a list of raw I/Q recordings with the programme's data() and peak_det(), run in a worker
+def recording_work(names):
+
+    results = []
+
+    for name in names:
+
+        sdr = RecordedRtlSdr(name)
+        settings, freq_mhz, capture_samples = recording_settings(sdr, num_avg, num_samples)
+        start_time = recording_time(sdr.meta)
+
+        for x in range(sdr.num_samples // capture_samples):
+
+            with contextlib.redirect_stdout(io.StringIO()):
+                spectrum, faxis, spectrum_last = programme.data(sdr, settings['num_avg'], settings['num_samples'], settings['mode'], zoom=settings['zoom'], target_freq=settings['target_freq'], overlap=settings['overlap'], window=settings['window'])
+
+            peaks = programme.peak_det(spectrum, faxis, freq_mhz, detector, cfar_settings)
+
+            result = numpy.zeros(1, dtype=result_dtype)
+            result['time'] = start_time + (x + 1) * capture_samples / sdr.sample_rate
+            result['freq_mhz'] = freq_mhz
+            result['amp'] = [peaks[0], peaks[2], peaks[4], peaks[6], peaks[8]]
+            result['freq'] = [peaks[1], peaks[3], peaks[5], peaks[7]]
+            result['source'] = os.path.basename(name)
+            result['row'] = x
+            results.append(result)
+
+        sdr.close()
+
+    if not results:
+        return numpy.zeros(0, dtype=result_dtype)
+
+    return numpy.concatenate(results)
+
+# Function to run one piece of work, the arguments say which
+def work(task):
+
+    if task[0] == 'archive':
+        return archive_work(*task[1:])
+
+    return recording_work(task[1])
+
+# Function to split the captures in a directory in to pieces of work
+def tasks(directory, iq):
+
+    found = []
+
+    if iq:
+        names = list_recordings(directory)
+        for start in range(0, len(names), recordings_per_chunk):
+            found.append(('recordings', names[start:start + recordings_per_chunk]))
+
+    else:
+        for name in list_archives(directory):
+            with open(name + '.json', 'r') as f:
+                header = json.load(f)
+
+            count = archive_length(name, header['num_bins'], numpy.dtype(header['dtype']))
+
+            for start in range(0, count, chunk):
+                found.append(('archive', name, start, min(start + chunk, count)))
+
+    return found
+
+# Function to write the results as one .CSV table, in time order
+def write_table(path, results):
+
+    results = results[numpy.argsort(results['time'], kind='stable')]
+
+    with open(path, 'w') as f:
+        writer = csv.writer(f, delimiter=',', quotechar='|', quoting=csv.QUOTE_MINIMAL, lineterminator='\n')
+        writer.writerow(['date', 'hour', 'time', 'band', 'amp_peak_1', 'freq_peak_1', 'amp_peak_2', 'freq_peak_2', 'amp_peak_3', 'freq_peak_3', 'amp_peak_4', 'freq_peak_4', 'noise', 'source', 'row'])
+
+        for result in results:
+            current_date, current_hour = stamp(result['time'])
+            amp = result['amp']
+            freq = result['freq']
+            writer.writerow([current_date, current_hour, '%.3f' % result['time'], result['freq_mhz'], amp[0], freq[0], amp[1], freq[1], amp[2], freq[2], amp[3], freq[3], amp[4], result['source'], result['row']])
+
+    return
+
+# Function to reprocess every capture in a directory on a pool of processes, returns the results table
+def reprocess(directory='.', output='reprocessed.csv', iq=reprocess_iq):
+
+    start_time = time.time()
+    pieces = tasks(directory, iq)
+
+    # only recordings need the programme's own capture functions
+    pool = multiprocessing.Pool(processes, initializer=start_worker if iq else None)
+
+    try:
+        # pieces of work are handed out as workers become free, results only hold the detected peaks
+        parts = []
+        for part in pool.imap_unordered(work, pieces):
+            parts.append(part)
+
+            print('Reprocessed %d of %d Pieces' % (len(parts), len(pieces)))
+
+    finally:
+        pool.close()
+        pool.join()
+
+    results = numpy.concatenate(parts) if parts else numpy.zeros(0, dtype=result_dtype)
+
+    write_table(os.path.join(directory, output), results)
+
+    print('Reprocessing Complete, %d Captures in %.1f Seconds, Results in %s' % (len(results), time.time() - start_time, os.path.join(directory, output)))
+
+    return results
+
+if __name__ == '__main__':
+
+    arguments = [argument for argument in sys.argv[1:] if not argument.startswith('--')]
+
+    reprocess(arguments[0] if arguments else '.', iq='--iq' in sys.argv or reprocess_iq)
@@ -1,17 +1,32 @@
 ## Imports ##
-from rtlsdr import RtlSdr
 import numpy
-import matplotlib.pyplot as plt
 import time
-import peakutils
-import csv
 import sys
-import gpsd
-#from gps3 import gps3
+import threading
+import queue
+from sdr_dsp import get_plan, get_zoom_plan, get_channelizer, get_window, RunningSpectrum, record_raw, fft_power, peak_det, peak_det_batch, strongest_first, bytes_to_iq, welch_step, welch_segments, sweep_centers, stitch
+from sdr_results import ResultWriter, TextSink, CsvSink, BinarySink
+from sdr_storage import IqRecorder, SpectrumStore, CaptureIndex
+from gps_service import GpsService
+from cycle_scheduler import CycleScheduler, sleep_until
+from sdr_metrics import stages
+from sdr_sim import SimulatedRtlSdr
 #import schedule
 
 
 
+try:
+    from rtlsdr import RtlSdr
+    
+except:
+    print("RTL SDR Driver Not Available on This Device, use --simulate\n")
+
+try:
+    import matplotlib.pyplot as plt
+    
+except:
+    print("Plotting Not Available on This Device\n")
+
 try:
     import RPi.GPIO as gpio
     
@@ -21,116 +36,6 @@ except:
  
 ## Function Definitions ##
 
-# def gps_loc():
-#             
-#     # Attempt to connect to GPS Dongle
-#     try:
-#         gps_socket = gps3.GPSDSocket()
-#         data_stream = gps3.DataStream()
-#         
-#         gps_socket.connect()
-#         gps_socket.watch()
-#         
-#         # create counter to monitor number of attempts to find location
-#         loc_count = 0
-#         new_count = 0
-#         
-#         # wait for new data
-#         for new_data in gps_socket:
-#             if new_data:
-#                 data_stream.unpack(new_data)
-#                 
-#                 # Find fix mode of device. 2 or 3 indicate lock. 1 is no lock. n/a is unknown     
-#                 loc_mode = data_stream.TPV['mode']
-#                 
-#                 # if fix mode is known
-#                 if loc_mode != 'n/a':
-#                     #change mode from string to integer
-#                     loc_mode = int(loc_mode)
-#                     
-#                     # If at least 2D fix (mode 2) is achieved, save longitude and latitude with dummy variable for altitude
-#                     if loc_mode == 2:
-#                         lon = data_stream.TPV['lon']
-#                         lat = data_stream.TPV['lat']
-#                         alt = 0
-#                         break
-#                      
-#                     # If at 3D fix (mode 3) is achieved, save longitude, latitude and altitude
-#                     elif loc_mode == 3:
-#                         lon = data_stream.TPV['lon']
-#                         lat = data_stream.TPV['lat']
-#                         alt = data_stream.TPV['alt']
-#                         break
-#                     
-#                     else:
-#                         loc_count += 1
-#                     
-#                 # If device takes too long to find location, terminate.
-#                 elif loc_count > 10:
-#                     lon = 0
-#                     lat = 0
-#                     alt = 0
-#                     break
-#                 
-#                 #advance attempts counter        
-#                 else:
-#                     loc_count += 1
-#         
-#             elif new_count > 1000000:
-#                 lon = 0
-#                 lat = 0
-#                 alt = 0
-#                 break
-#             
-#             else:
-#                 new_count += 1
-#         
-#         #disconnect from GPS
-#         gps_socket.close()   
-#                 
-#     # if unable to connect, save dummy variables, alert user and exit
-#     except:
-#         print('GPS Not Available on This Device\n')
-#         lon = 0
-#         lat = 0
-#         alt = 0
-#     
-#     return lon, lat, alt
-
-# # Function to read GPS location from a USB GPS dongle
-def gps_loc():
-       
-    # Attempt to connect to GPS Dongle
-    try:
-        # Connect to the local gpsd
-        #gpsd.connect()
-   
-        # Get gps position
-        location = gpsd.get_current()
-   
-        # If at least 2D fix (mode 2 or 3) is achieved, save longitude and latitude
-        if location.mode >= 2:
-            lon = location.lon
-            lat = location.lat
-        else:
-            lon = 0
-            lat = 0
-           
-        # If at 3D fix (mode 3) is achieved, save altitude
-        if location.mode >= 3:
-            alt = location.alt
-        else:
-            alt = 0
-       
-    # if unable to connect, save dummy variables, alert user and exit
-    except:
-        print('GPS Not Available\n')
-        lon = 0
-        lat = 0
-        alt = 0
-       
-    return lon, lat, alt
-
 # Function to produce strings with time and date
 def time_date():
     # string including date and time
@@ -144,241 +49,439 @@ def time_date():
     
     return current_date, current_hour, current_time, time_for_save
 
-# Function to detect peaks in the data
-def peak_det(spectrum, faxis, freq_mhz):
-    # Find peaks in the data using a peak detector (good for more that 1 peak, min_dist needs work)
-    indexes = peakutils.peak.indexes(spectrum.real,thres=0.2, min_dist=50)
-    #indexes = signal.find_peaks_cwt(spectrum, numpy.arange(1,10))
-             
-    # Make an array of peak amplitudes and corresponding frequencies from detected peak indexes
-    x = 0
-    peaks = []
-    freq = []
-    while x < len(indexes):
-        peaks.append(spectrum.real[indexes[x]])
-        freq.append(faxis[indexes[x]])
-        x += 1
-        
-    # search for peak at frequency closest to frequency of interest
-    # subtract frequency of interest from frequencies the peaks are detected at.
-    search = []
-    for i in freq:
-        search.append(i - freq_mhz)
-    
-    # convert values to absolute
-    abs_search = numpy.abs(search)
-    
-    # lowest number will be closest to frequency of interest
-    # find the index of this number in the list
-    min_index = numpy.argmin(abs_search)
+# Function to display results and add them to the buffered .CSV, .TXT and binary logs
+def display_write(results, current_date, current_hour, amp_peak_1, freq_peak_1, amp_peak_2, freq_peak_2, amp_peak_3, freq_peak_3, amp_peak_4, freq_peak_4, amp_peak_5, freq_peak_5, lon, lat, alt):
+    # print first 2 detected peaks
+    print('%s %s Peaks: %.2f dB at %.3f MHz, %.2f dB at %.3f MHz, %.2f dB at %.3f MHz, %.2f dB at %.3f MHz and %.2f dB for %s \nLocation: Longitude %.3f, Latitude %.3f, Altitude %.3fm\n' % (current_date, current_hour, amp_peak_1, freq_peak_1, amp_peak_2, freq_peak_2, amp_peak_3, freq_peak_3, amp_peak_4, freq_peak_4, amp_peak_5, freq_peak_5, lon, lat, alt))
+
+    # write peaks to every log, files are only written when the buffer fills or times out
+    results.write([current_date, current_hour, amp_peak_1, freq_peak_1, amp_peak_2, freq_peak_2, amp_peak_3, freq_peak_3, amp_peak_4, freq_peak_4, amp_peak_5, freq_peak_5, lon, lat, alt])
+
+    return
+
+# Function to display the measured channels and add them to the buffered channel log
+def channel_write(channel_results, current_date, current_hour, freqs, centres, power, peak, noise, lon, lat, alt):
+
+    for freq_mhz, centre, power_db, peak_db, noise_db in zip(freqs, centres, power, peak, noise):
+        print('%s %s Channel %.3f MHz: %.2f dB mean, %.2f dB peak, %.2f dB noise' % (current_date, current_hour, centre, power_db, peak_db, noise_db))
+
+        channel_results.write([current_date, current_hour, freq_mhz, centre, power_db, peak_db, noise_db, lon, lat, alt])
+
+    print('')
+
+    return
+
+# Function to read one block and take its FFT, the raw bytes are passed to the recorder if one is given
+def fft(sdr, num_samples, recorder=None):
     
-    # check peak is close enough to the frequency of interest
-    if (freq_mhz-0.05) < freq[min_index] < (freq_mhz+0.05):
-        
+    try:
+        # Read in samples from the device
+        with stages.time('read_block'):
+            if recorder is None:
+                samples = sdr.read_samples(num_samples)
+            else:
+                # the raw bytes are kept, so they are converted here in the same way as read_samples()
+                raw = sdr.read_bytes(2 * num_samples)
+                samples = bytes_to_iq(raw, numpy.zeros(num_samples, dtype=numpy.complex128))
         
-        amp_peak_1 = peaks[min_index]
-        freq_peak_1 = freq[min_index]
+        # keep the raw bytes if the capture is being recorded
+        if recorder is not None:
+            record_raw(recorder, raw)
+    
+        with stages.time('fft_block'):
+            # window for this size and band is only built once
+            w = get_plan(num_samples, sdr.sample_rate, sdr.center_freq).window
+            # Process fft
+            # take fft of samples
+            fft = numpy.fft.fft(samples*w)
             
-        #print('Primary measurement used')            
-        #print('Close Peak Detected\n')
-        
-    # if peak detected isn't close enough use bin average
-    else:
-        
-        # search for bins closest to frequency of interest and save
-        search_freq = []
-        for i in faxis:
-            search_freq.append(i - freq_mhz)
-    
-        # convert values to absolute
-        abs_search_freq = numpy.abs(search_freq)
+            # convert to dB
+            spectrum = 20 * numpy.log10(abs(fft*2)) 
     
-        # lowest number will be closest to frequency of interest
-        # find the index of this number in the list
-        min_index_freq = numpy.argmin(abs_search_freq)
+    except:
+        spectrum = 0
                 
-        amp_peak_1 = spectrum[min_index_freq]
-        freq_peak_1 = faxis[min_index_freq]
+    return spectrum
+
+# Function to read all samples for every average at once and take the FFTs as one batch
+def fft_batch(sdr, num_avg, num_samples, recorder=None):
+    
+    try:
+        # Read in the raw bytes for every average in a single transfer
+        with stages.time('read'):
+            raw = sdr.read_bytes(2 * num_avg * num_samples)
         
-        #print('Central Bin Measurement Recorded') 
-        #print('No Close Peak Detected\n')
+        # keep the raw bytes if the capture is being recorded
+        record_raw(recorder, raw)
     
+        with stages.time('fft'):
+            plan = get_plan(num_samples, sdr.sample_rate, sdr.center_freq)
+            block, power = plan.batch_buffers(num_avg)
+            
+            # convert to samples with one row per FFT
+            bytes_to_iq(raw, block.reshape(-1))
+            
+            # take fft of every windowed row at once
+            block *= plan.window
+            fft = numpy.fft.fft(block, axis=1)
+            
+            # average in the power domain, |2X|^2 keeps the same scaling as fft()
+            fft_power(fft, power)
+            
+            # convert to dB
+            spectrum = 10 * numpy.log10(numpy.mean(power, axis=0))
+            
+            # spectrum of the last row, equivalent to the last fft() call of the loop
+            spectrum_last = 10 * numpy.log10(power[-1])
     
-    # take an average of the bins excluding peaks to estimate noise
-
-    avg_bin = 0
+    except:
+        spectrum = numpy.zeros(num_samples)
+        spectrum_last = 0
     
-    for i in spectrum:
-        avg_bin = avg_bin + i
-        
-    for i in peaks:
-        avg_bin = avg_bin - i 
-  
-    avg_bin = avg_bin/(len(spectrum)-len(peaks))
+    return spectrum, spectrum_last
+
+# Function to average the FFTs of num_avg overlapping segments of num_samples, Welch's method
+# segments start num_samples*(1-overlap) apart in one read, so fewer samples are needed for the same number of averages
+# as with fft(), levels depend on the window used
+def fft_welch(sdr, num_avg, num_samples, overlap=0.5, window='hamming', recorder=None):
     
-    #print('Primary Measurement:')    
-    #print('%.3f dBm' % (peaks[min_index]-144))
-    #print('%.4f MHz'% freq[min_index]) 
+    # an overlap or window that cannot be used raises ValueError rather than giving an empty spectrum
+    plan = get_plan(num_samples, sdr.sample_rate, sdr.center_freq, window)
+    step = welch_step(num_samples, overlap)
+    length = num_samples + (num_avg - 1) * step
     
-    #print('\nEstimated Noise Measurement:')    
-    #print('%.3f dBm' % (avg_bin-144))
-    #print('%.4f MHz'% faxis[2500]) 
+    try:
+        # Read in the raw bytes for every segment in a single transfer
+        with stages.time('read'):
+            raw = sdr.read_bytes(2 * length)
+        
+        # keep the raw bytes if the capture is being recorded
+        record_raw(recorder, raw)
         
-    # order detected peaks from small to large
-    peaks_index = numpy.argsort(peaks)
+        with stages.time('fft'):
+            samples = plan.sample_buffer(length)
+            block, power = plan.batch_buffers(num_avg)
+            
+            bytes_to_iq(raw, samples)
+            
+            # every segment is a view of the one buffer, windowing writes them in to the batch buffer
+            numpy.multiply(welch_segments(samples, num_samples, step), plan.window, out=block)
+            fft = numpy.fft.fft(block, axis=1)
+            
+            # average in the power domain, |2X|^2 keeps the same scaling as fft()
+            fft_power(fft, power)
+            
+            # convert to dB
+            spectrum = 10 * numpy.log10(numpy.mean(power, axis=0))
+            spectrum_last = 10 * numpy.log10(power[-1])
     
-    # use peak index to retrieve data from data sets, insert dummy data if the peak index is not long enough (less than 4 peaks detected)
-    x = 0
+    # the device failed to read
+    except IOError:
+        spectrum = numpy.zeros(num_samples)
+        spectrum_last = 0
     
-    if x < len(peaks_index):
-        amp_peak_2 = peaks[peaks_index[len(peaks_index)-1]]
-        freq_peak_2 = freq[peaks_index[len(peaks_index)-1]]
-        
-        x+=1
+    return spectrum, spectrum_last
+
+# size of the full band FFT zoomed levels are scaled to, as the num_samples of the bands that are not zoomed
+zoom_reference_samples = 5000
+
+# Function to capture a zoomed spectrum around target_freq, by mixing, filtering and decimating before a smaller FFT
+# the FFT of num_samples covers sample_rate/zoom and its central half is returned
+# levels are scaled so a carrier reads the same as in a full band FFT of zoom_reference_samples, so peaks can be compared with the other modes
+# the noise in each narrower bin reads lower than in a full band bin, by the ratio of the bin widths
+def fft_zoom(sdr, num_avg, num_samples, zoom, target_freq, recorder=None):
     
-    else:
-        amp_peak_2 = 0
-        freq_peak_2 = 0
+    try:
+        plan = get_zoom_plan(num_samples, sdr.sample_rate, sdr.center_freq, target_freq, zoom)
+        
+        # Read in the raw bytes for every average in a single transfer
+        with stages.time('read'):
+            raw = sdr.read_bytes(2 * num_avg * plan.input_samples)
         
-    if x < len(peaks_index):
-        amp_peak_3 = peaks[peaks_index[len(peaks_index)-2]]
-        freq_peak_3 = freq[peaks_index[len(peaks_index)-2]]
+        # keep the raw bytes if the capture is being recorded
+        record_raw(recorder, raw)
         
-        x+=1
+        with stages.time('fft'):
+            # move the frequency of interest to 0 Hz and keep only the band around it
+            zoomed = plan.decimate(raw, num_avg)
+            
+            # take fft of every windowed row at once, keeping the bins the filter passes unaltered
+            zoomed *= plan.window
+            fft = numpy.fft.fft(zoomed, axis=1)[:, plan.kept]
+            
+            # average in the power domain, |2X|^2 scaled by the ratio of the FFT sizes squared gives a carrier the level of the reference FFT
+            power = fft_power(fft, numpy.empty(fft.shape))
+            power *= (zoom_reference_samples / num_samples)**2
+            
+            # convert to dB
+            spectrum = 10 * numpy.log10(numpy.mean(power, axis=0))
+            spectrum_last = 10 * numpy.log10(power[-1])
     
-    else:
-        amp_peak_3 = 0
-        freq_peak_3 = 0
+    except:
+        spectrum = numpy.zeros(2 * (num_samples // 4))
+        spectrum_last = 0
+    
+    return spectrum, spectrum_last
+
+# Function to average only until the level at target_freq and the noise level are both known to within tolerance_db
+# blocks are read and transformed step at a time, never fewer than min_avg and never more than max_avg
+# the half width of the 95% confidence interval of each level's mean is compared with the tolerance, returns the number of averages used as well
+def fft_adaptive(sdr, max_avg, num_samples, target_freq, tolerance_db, min_avg=10, step=10, recorder=None):
+    
+    try:
+        plan = get_plan(num_samples, sdr.sample_rate, sdr.center_freq)
+        block, power = plan.batch_buffers(step)
+        iq, power_sum = plan.block_buffers()
+        power_sum[:] = 0
         
-    if x < len(peaks_index):
-        amp_peak_4 = peaks[peaks_index[len(peaks_index)-3]]
-        freq_peak_4 = freq[peaks_index[len(peaks_index)-3]]
+        # bins within 0.05MHz of target_freq, where peak_det() looks for the peak, in unshifted order
+        offsets = numpy.fft.fftfreq(num_samples, 1/sdr.sample_rate) + sdr.center_freq - target_freq
+        search = numpy.nonzero(numpy.abs(offsets) < 0.05e6)[0]
         
-        x+=1
-    
-    else:
-        amp_peak_4 = 0
-        freq_peak_4 = 0
+        # power of each block in the search bins, and the noise level of each block from the median of its bins
+        levels = numpy.zeros((max_avg, len(search)))
+        noise = numpy.zeros(max_avg)
         
-    
-    # Save noise measurement 
-    amp_peak_5 = avg_bin
-    freq_peak_5 = 'noise'
+        # largest half width of the interval allowed, relative to the mean
+        limit = 10**(tolerance_db/10) - 1
         
-    # use peak index to retrieve data from data sets
-    #amp_peak_2 = peaks[peaks_index[len(peaks_index)-1]]
-    #freq_peak_2 = freq[peaks_index[len(peaks_index)-1]]
-    #amp_peak_3 = peaks[peaks_index[len(peaks_index)-2]]
-    #freq_peak_3 = freq[peaks_index[len(peaks_index)-2]]
-    #amp_peak_4 = peaks[peaks_index[len(peaks_index)-3]]
-    #freq_peak_4 = freq[peaks_index[len(peaks_index)-3]]
-    #amp_peak_5 = peaks[peaks_index[len(peaks_index)-4]]
-    #freq_peak_5 = freq[peaks_index[len(peaks_index)-4]]
-
-    return amp_peak_1, freq_peak_1, amp_peak_2, freq_peak_2, amp_peak_3, freq_peak_3, amp_peak_4, freq_peak_4, amp_peak_5, freq_peak_5, indexes
-
-# Function to display results and write to a .CSV and .TXT file
-def display_write(current_date, current_hour, amp_peak_1, freq_peak_1, amp_peak_2, freq_peak_2, amp_peak_3, freq_peak_3, amp_peak_4, freq_peak_4, amp_peak_5, freq_peak_5, lon, lat, alt):
-    # print first 2 detected peaks
-    print('%s %s Peaks: %.2f dB at %.3f MHz, %.2f dB at %.3f MHz, %.2f dB at %.3f MHz, %.2f dB at %.3f MHz and %.2f dB for %s \nLocation: Longitude %.3f, Latitude %.3f, Altitude %.3fm\n' % (current_date, current_hour, amp_peak_1, freq_peak_1, amp_peak_2, freq_peak_2, amp_peak_3, freq_peak_3, amp_peak_4, freq_peak_4, amp_peak_5, freq_peak_5, lon, lat, alt))
-
-    # write peaks to a text file
-    with open("log.txt","a") as f:
-        f.write('%s %s Peaks: %.2f dB at %.3f MHz, %.2f dB at %.3f MHz, %.2f dB at %.3f MHz, %.2f dB at %.3f MHz and %.2f dB for %s Location: Longitude %.3f, Latitude %.3f, Altitude %.3fm\n' % (current_date, current_hour, amp_peak_1, freq_peak_1, amp_peak_2, freq_peak_2, amp_peak_3, freq_peak_3, amp_peak_4, freq_peak_4, amp_peak_5, freq_peak_5, lon, lat, alt))
+        x = 0
+        while x < max_avg:
+            rows = min(step, max_avg - x)
+            
+            with stages.time('read'):
+                raw = sdr.read_bytes(2 * rows * num_samples)
+            
+            # keep the raw bytes if the capture is being recorded
+            record_raw(recorder, raw)
+            
+            with stages.time('fft'):
+                # take fft of every windowed row at once, with the same scaling as fft()
+                bytes_to_iq(raw, block[:rows].reshape(-1))
+                block[:rows] *= plan.window
+                fft = numpy.fft.fft(block[:rows], axis=1)
+                fft_power(fft, power[:rows])
+                
+                power_sum += power[:rows].sum(axis=0)
+                levels[x:x + rows] = power[:rows, search]
+                noise[x:x + rows] = numpy.median(power[:rows], axis=1)
+            
+            x += rows
+            
+            if x < min_avg:
+                continue
+            
+            # the target is the search bin with the highest mean so far
+            target = levels[:x, numpy.argmax(levels[:x].mean(axis=0))]
+            spread = 1.96 / numpy.sqrt(x) * max(target.std(ddof=1) / target.mean(), noise[:x].std(ddof=1) / noise[:x].mean())
+            
+            if spread <= limit:
+                break
         
-    f.close()
-
-    #write peaks to a .CSV file
-    with open('log.csv', 'a') as csvfile:
-        writer = csv.writer(csvfile, delimiter=',', quotechar='|', quoting=csv.QUOTE_MINIMAL, lineterminator = '\n')
-        writer.writerow([current_date] + [current_hour] + [amp_peak_1] + [freq_peak_1] + [amp_peak_2] + [freq_peak_2] + [amp_peak_3] + [freq_peak_3] + [amp_peak_4] + [freq_peak_4] + [amp_peak_5] + [freq_peak_5] + [lon] + [lat] + [alt])
-
-    csvfile.close()
-
-    return
+        # convert to dB
+        spectrum = 10 * numpy.log10(power_sum / x)
+        spectrum_last = 10 * numpy.log10(power[rows - 1])
+    
+    except:
+        spectrum = numpy.zeros(num_samples)
+        spectrum_last = 0
+        x = 0
+    
+    return spectrum, spectrum_last, x
 
-def fft(sdr, num_samples):
+# Function to read raw bytes from the device in to a ring of buffers, run on its own thread
+# with num_avg None it reads until status['stop'] is set
+def stream_read(sdr, num_avg, num_samples, ring, free, full, status, recorder=None):
     
     try:
-        # Read in samples from the device
-        samples = sdr.read_samples(num_samples)
+        x = 0
+        while num_avg is None or x < num_avg:
+            # wait for the consumer to hand back an empty buffer
+            index = free.get()
+            
+            if status.get('stop'):
+                break
+            
+            # read the interleaved 8 bit I/Q bytes straight in to the buffer
+            with stages.time('read_block'):
+                raw = sdr.read_bytes(2 * num_samples)
+                ring[index][:] = numpy.frombuffer(raw, dtype=numpy.uint8, count=2 * num_samples)
+            
+            # keep the raw bytes if the capture is being recorded
+            record_raw(recorder, ring[index])
+            
+            # pass the full buffer to the consumer
+            full.put(index)
+            x += 1
+    
+    except:
+        status['error'] = True
     
-        w = numpy.hamming(num_samples)            
-        # Process fft
-        # take fft of samples
-        fft = numpy.fft.fft(samples*w)
+    # tell the consumer no more buffers are coming
+    full.put(None)
+    
+    return
+
+# Function to stream samples on a reader thread while the FFTs are taken and averaged on this thread
+def stream_data(sdr, num_avg, num_samples, num_buffers=4, recorder=None):
+    
+    # ring of raw buffers and the working arrays are preallocated in the plan
+    plan = get_plan(num_samples, sdr.sample_rate, sdr.center_freq)
+    ring = plan.ring_buffers(num_buffers)
+    iq, power_avg = plan.block_buffers()
+    power_avg[:] = 0
+    block, power = plan.batch_buffers(1)
+    power = power[0]
+    w = plan.window
+    
+    # queues of buffer indexes waiting to be filled and waiting to be processed
+    free = queue.Queue()
+    full = queue.Queue()
+    for index in range(num_buffers):
+        free.put(index)
+    
+    status = {'error': False}
+    
+    reader = threading.Thread(target=stream_read, args=(sdr, num_avg, num_samples, ring, free, full, status, recorder))
+    reader.daemon = True
+    reader.start()
+    
+    x = 0
+    while True:
+        index = full.get()
         
-        # convert to dB
-        spectrum = 20 * numpy.log10(abs(fft*2)) 
+        # reader has finished or failed
+        if index is None:
+            break
+        
+        with stages.time('fft_block'):
+            # convert bytes to samples in the same way as read_samples()
+            bytes_to_iq(ring[index], iq)
+            
+            # the raw bytes have been used, return the buffer to the reader
+            free.put(index)
+            
+            iq *= w
+            
+            # take fft and accumulate in the power domain with the same scaling as fft()
+            fft = numpy.fft.fft(iq)
+            fft_power(fft, power)
+            power_avg += power
+        x += 1
     
-    except:
-        spectrum = 0
-                
-    return spectrum
+    reader.join()
+    
+    if status['error'] or x == 0:
+        return numpy.zeros(num_samples), 0
+    
+    # convert to dB
+    spectrum = 10 * numpy.log10(power_avg / x)
+    spectrum_last = 10 * numpy.log10(power)
+    
+    return spectrum, spectrum_last
 
 # Function to get samples and create FFT
-def data(sdr, num_avg, num_samples):
+# with zoom set the FFT covers sample_rate/zoom around target_freq in place of the full band
+# overlap and window are used by the 'welch' mode
+def data(sdr, num_avg, num_samples, mode='batch', recorder=None, zoom=None, target_freq=None, overlap=0.5, window='hamming'):
 
     print("Data Capture in Progress........\n") 
     
-    x = 1
-    a = 1
-    spectrum_avg = numpy.zeros(num_samples)
-    
-    while x <= num_avg:
-        #time.sleep(0.1)
-        spectrumA = fft(sdr, num_samples)
-        spectrum_avg = spectrum_avg + spectrumA
-        #print (spectrum_avg)
-        #print (spectrumA)
-        if a == 100:
-            percent_comp = (x/num_avg)*100
-            print("%d Averages Taken" % x)
-            print("Sampling %.2f %% Complete\n"  % percent_comp)
-            
-            a = 1
-        else:
-            a += 1
-        x += 1
-     
+    start_time = time.time()
+    
+    # zoomed mode, only the band around the frequency of interest is transformed
+    if zoom is not None:
+        spectrum, spectrumA = fft_zoom(sdr, num_avg, num_samples, zoom, target_freq, recorder)
     
-    spectrum = spectrum_avg / num_avg
+    # batched mode, one read and one vectorised FFT for all averages
+    elif mode == 'batch':
+        spectrum, spectrumA = fft_batch(sdr, num_avg, num_samples, recorder)
+    
+    # welch mode, num_avg overlapping segments of one read as one vectorised FFT
+    elif mode == 'welch':
+        spectrum, spectrumA = fft_welch(sdr, num_avg, num_samples, overlap, window, recorder)
+    
+    # streaming mode, reads overlap with FFTs on a separate thread
+    elif mode == 'stream':
+        spectrum, spectrumA = stream_data(sdr, num_avg, num_samples, recorder=recorder)
+    
+    # original mode, one read and one FFT per average, averaged in dB
+    else:
+        x = 1
+        a = 1
+        spectrum_avg = numpy.zeros(num_samples)
+        
+        while x <= num_avg:
+            #time.sleep(0.1)
+            spectrumA = fft(sdr, num_samples, recorder)
+            spectrum_avg = spectrum_avg + spectrumA
+            #print (spectrum_avg)
+            #print (spectrumA)
+            if a == 100:
+                percent_comp = (x/num_avg)*100
+                print("%d Averages Taken" % x)
+                print("Sampling %.2f %% Complete\n"  % percent_comp)
+                
+                a = 1
+            else:
+                a += 1
+            x += 1
+         
+        
+        spectrum = spectrum_avg / num_avg
     #print (spectrum)
     
     #spectrum, faxis, samples = data(sdr)
     
-    print("Data Capture Complete\n")    
+    print("Data Capture Complete, %.1f Blocks per Second\n" % (num_avg / (time.time() - start_time)))
 
     #print ("FFT Ready\n")
     
     # shift the fft so Fc is at the centre of the plot
     spectrum = numpy.fft.fftshift(spectrum)
-                    
-    array_length = len(spectrum)
-        
-    # create frequency axis, noting that Fc is in centre
-    fstep = sdr.sample_rate/len(spectrum) # fft bin size
-    fstep = fstep / 1000000 #  convert to MHz
-        
-    faxis = []
-    k = 0
-    while k < array_length:
-        # create f axis with Fc in the centre
-        faxis.append(((sdr.center_freq/1000000)-(fstep*(len(spectrum)/2))) + k * fstep)
-        # below creates f axis with Fc at the start
-        # faxis.append((sdr.center_freq/1000000) + k * fstep)
-        k = k + 1
+    
+    # frequency axis with Fc in the centre, built once per size and band
+    if zoom is not None:
+        faxis = get_zoom_plan(num_samples, sdr.sample_rate, sdr.center_freq, target_freq, zoom).faxis
+    else:
+        faxis = get_plan(num_samples, sdr.sample_rate, sdr.center_freq).faxis
 
 
     return spectrum, faxis,spectrumA
 
+# Function to get samples and create FFT, taking only as many of the num_avg averages as tolerance_db needs
+# returns the number of averages used as well as the results of data()
+def adaptive_data(sdr, num_avg, num_samples, target_freq, tolerance_db, recorder=None):
+    
+    print("Adaptive Data Capture in Progress........\n")
+    
+    start_time = time.time()
+    
+    spectrum, spectrumA, used = fft_adaptive(sdr, num_avg, num_samples, target_freq, tolerance_db, recorder=recorder)
+    
+    print("Data Capture Complete, %d of %d Averages Used, %.1f Blocks per Second\n" % (used, num_avg, used / (time.time() - start_time)))
+    
+    # shift the fft so Fc is at the centre of the plot
+    spectrum = numpy.fft.fftshift(spectrum)
+    
+    # frequency axis with Fc in the centre, built once per size and band
+    faxis = get_plan(num_samples, sdr.sample_rate, sdr.center_freq).faxis
+    
+    return spectrum, faxis, spectrumA, used
+
 # Function to set up and configure SDR
-def sdr_control(freq,i,flag):
+# device is None for the first dongle found, an index or a serial number string
+def sdr_control(freq,i,flag,device=None):
     
     try:
         
         # Create device
-        sdr = RtlSdr()
+        if device is None:
+            sdr = RtlSdr()
+        elif isinstance(device, str):
+            sdr = RtlSdr(serial_number=device)
+        else:
+            sdr = RtlSdr(device_index=device)
 
         # configure device
         sdr.sample_rate = 2.048e6  # Hz
@@ -398,7 +501,7 @@ def sdr_control(freq,i,flag):
             time.sleep(1)
             print("Attempting to Re-establish Connection...... Attempt: %d\n" %i)
             i = i + 1
-            sdr, flag = sdr_control(freq,i,flag)
+            sdr, flag = sdr_control(freq,i,flag,device)
             
         else:
             
@@ -413,6 +516,109 @@ def sdr_control(freq,i,flag):
        
     return sdr, flag
 
+# Class to keep one SDR device open for the whole run and retune it between bands
+class SdrSession:
+    
+    def __init__(self, settle_samples=16384, device=None):
+        
+        self.sdr = None
+        # dongle to open, None for the first found, an index or a serial number string
+        self.device = device
+        self.freq = None
+        self.gain = None
+        # number of samples to throw away after each retune while the tuner settles
+        self.settle_samples = settle_samples
+        # set once the device has needed to be reconnected
+        self.flag = False
+    
+    # Function to tune the open device to a new frequency, opening it first if needed
+    def tune(self, freq, gain=49):
+        
+        try:
+            if self.sdr is None:
+                self.open(freq)
+            
+            # only retune what has changed
+            if freq != self.freq:
+                self.sdr.center_freq = freq+0.1e6   # Hz
+                self.freq = freq
+            
+            if gain != self.gain:
+                self.sdr.gain = gain
+                self.gain = gain
+            
+            # discard samples captured while the tuner was settling
+            self.sdr.read_samples(self.settle_samples)
+        
+        except:
+            
+            print("RTL SDR Communication Error During Retune")
+            
+            # only reopen the device on a real error
+            self.reopen(freq, gain)
+            
+        return self.sdr
+    
+    # Function to close and reopen the device until it reads again, giving up after as many attempts as sdr_control()
+    def reopen(self, freq, gain, attempts=60):
+        
+        for i in range(1, attempts + 1):
+            
+            try:
+                self.close()
+                self.open(freq)
+                self.sdr.gain = gain
+                self.gain = gain
+                self.sdr.read_samples(self.settle_samples)
+                
+                self.flag = True
+                return
+            
+            # sdr_control() has already retried opening if it exits, so only errors from a device that opened are retried here
+            except Exception:
+                
+                time.sleep(1)
+                print("Attempting to Re-establish Connection...... Attempt: %d\n" %i)
+        
+        # gpio disconnect
+        try:
+            gpio.cleanup()
+        except:
+            print("GPIO Not Deactivated")
+        
+        # exit programme with an error message
+        sys.exit("RTL SDR Device Not Responding\n")
+    
+    # Function to open and configure the device
+    def open(self, freq):
+        
+        #RTL re-connections counter
+        i = 1
+        
+        self.sdr, self.flag = sdr_control(freq, i, self.flag, self.device)
+        self.freq = freq
+        self.gain = None
+        
+        return
+    
+    # Function to release the device
+    def close(self):
+        
+        try:
+            # Disconnect SDR
+            if self.sdr is not None:
+                self.sdr.close()
+            
+        except:
+            
+            print('\nFailed to Close RTL SDR\n' )
+        
+        self.sdr = None
+        self.freq = None
+        self.gain = None
+        
+        return
+
 # Function to set up Rpi gpio for antenna switching
 def gpio_set():
     
@@ -431,21 +637,26 @@ def gpio_set():
 
     return
 
-# function to switch antenna
-def gpio_switch(chan, state):
+# function to switch antenna, returns the time the switch will have settled by
+# with wait=False the caller can do other work, such as retuning, before sleep_until() the returned time
+def gpio_switch(chan, state, settle=0.5, wait=True):
+    
+    settled = time.time() + settle
     
     try:
 
-        # activate selected gpio
-        gpio.output(chan, state)
+        with stages.time('gpio'):
+            # activate selected gpio
+            gpio.output(chan, state)
 
-        # wait for switch
-        time.sleep(0.5)
+            # wait for switch
+            if wait:
+                sleep_until(settled)
     
     except:
         print("GPIO Not Switched")
     
-    return
+    return settled
 
 # Function to plot the FFT's to aid debugging
 def debug_graph(faxis,spectrum,indexes, amp_peak_1, freq_peak_1, amp_peak_5, faxis2,spectrum2,indexes2, amp_peak_12, freq_peak_12, amp_peak_52):
@@ -553,171 +764,636 @@ def debug_graph(faxis,spectrum,indexes, amp_peak_1, freq_peak_1, amp_peak_5, fax
     
     return
 
-# Function to save the unprocessed sampled data for possible later use
-def raw_save(time_for_save,freq_mhz,sample_rate,samples):
+# Function to save the averaged spectrum for possible later use, in to the archive for its band and day
+def raw_save(store, freq_mhz, center_freq, sample_rate, spectrum, zoom=None, faxis=None):
+    
+    # add the spectrum to the archive with the time and tuning it was captured with
+    # a zoomed spectrum is stored with the centre and width of its axis, so the axis can be rebuilt with get_plan()
+    # in an archive of its own, named by its zoom and width, as it is not the width of the band's full band spectra
+    if zoom is not None:
+        width = len(faxis) * (faxis[1] - faxis[0]) * 1000000
+        name, row = store.append(freq_mhz, spectrum, time.time(), faxis[0]*1000000 + width/2, width, 'zoom%d-%d' % (zoom, len(spectrum)))
+    else:
+        name, row = store.append(freq_mhz, spectrum, time.time(), center_freq, sample_rate)
+    
+    # print confirmation of archive and row used to terminal
+    print ('%s row %d saved \n' % (name, row))
     
-    # convert sample rate to MHz
-    sample_rate = sample_rate/1000000
+    return name, row
+
+# Function to start recording the raw I/Q samples of a capture with their metadata
+# settings are the capture settings replay needs to process the recording in the same way
+def iq_start(freq_mhz, sdr, lon, lat, alt, settings=None):
     
-    # save samples to .NPY file
-    numpy.save('%s-%.1fMHz-%.4fMHz-raw_samples' % (time_for_save,freq_mhz,sample_rate) , samples)
+    # file name in the same format as the saved spectra
+    time_for_save = time.strftime("%m_%d_%y-%H_%M_%S")
     
-    # print confirmation of file name used to terminal
-    print ('%s-%.1fMHz-%.4fMHz-raw_samples file saved \n' % (time_for_save,freq_mhz,sample_rate))
+    name = '%s-%.1fMHz-%.4fMHz-raw_iq' % (time_for_save, freq_mhz, sdr.sample_rate/1000000)
     
-    return 
+    return IqRecorder(name, sdr.center_freq, sdr.sample_rate, sdr.gain, lon, lat, alt, settings=settings)
+
+# Class keeping the raw bytes of a capture in memory so the channelizer can use the same capture, passed to data() as its recorder
+class CaptureTap:
+
+    def __init__(self, recorder=None):
+
+        self.chunks = []
+        # recorder the bytes are passed on to, if the capture is also being recorded
+        self.recorder = recorder
+
+    def write(self, raw):
+
+        self.chunks.append(bytes(raw))
+
+        if self.recorder is not None:
+            self.recorder.write(raw)
+
+        return
+
+    # Function to return every byte of the capture
+    def raw(self):
+
+        return b''.join(self.chunks)
 
 
 ## Main Body ##
 
-# Get Location
-def test(flag):
+# settings of each band, captured in this order
+# freq in Hz, pin of the band's antenna switch, num_avg averages of num_samples point FFTs
+# peak detector 'threshold', 'cfar_ca' or 'cfar_os', with cfar settings passed to cfar() or None for its defaults, e.g. {'guard': 4, 'train': 32, 'scale_db': 6.0, 'rank': 0.75}
+# record_iq saves the raw I/Q samples of the capture as well as the spectrum
+# zoom is None for the full band, or a decimation factor to only transform 2.048MHz/zoom around the band, e.g. 8 with num_samples 2048
+# channels are frequencies in MHz to measure from the same capture with the channelizer, or None, e.g. [70.95, 71.0, 71.06]
+# num_channels the 2.048MHz capture is split in to, each 2.048MHz/num_channels wide
+# device is the dongle capturing the band when bands are captured at once, an index or a serial number string
+# tolerance in dB stops averaging once the band's level and the noise level are both known to within it, num_avg is then the most taken
+# None always takes num_avg, and zoomed bands always do
+# mode is the capture mode of data(), 'batch', 'stream', 'loop' or 'welch' for num_avg segments overlapping by overlap, e.g. 0.5 to 0.75, with the window given
+# a band with a tolerance is captured block by block as in 'batch' whatever its mode, so a tolerance cannot be set with 'welch'
+bands = [
+    {'freq': 71e6, 'pin': 18, 'num_avg': 100, 'num_samples': 5000, 'detector': 'threshold', 'cfar': None, 'record_iq': False, 'zoom': None, 'channels': None, 'num_channels': 128, 'device': 0, 'tolerance': None, 'mode': 'batch', 'overlap': 0.5, 'window': 'hamming'},
+    {'freq': 869.525e6, 'pin': 16, 'num_avg': 100, 'num_samples': 5000, 'detector': 'threshold', 'cfar': None, 'record_iq': False, 'zoom': None, 'channels': None, 'num_channels': 128, 'device': 1, 'tolerance': None, 'mode': 'batch', 'overlap': 0.5, 'window': 'hamming'},
+]
+
+# Function to check the settings of a band, settings that could not be honoured are refused before any capture
+def band_check(band):
     
-    #start_time = time.time()
-    #print("--- %s seconds ---" % (time.time() - start_time))
+    if band['tolerance'] is not None and band['zoom'] is None and band['mode'] == 'welch':
+        raise ValueError("Band at %.3f MHz: a tolerance cannot be used with the 'welch' mode" % (band['freq']/1000000))
     
-    # Set up GPIO
-    gpio_set()
+    # an overlap or window that cannot be used would otherwise only show as an empty spectrum each cycle
+    try:
+        welch_step(band['num_samples'], band['overlap'])
+        get_window(band['window'], band['num_samples'])
     
-    # Set first frequency of interest and display in MHz
-    freq = 71e6
+    except ValueError as error:
+        raise ValueError("Band at %.3f MHz: %s" % (band['freq']/1000000, error))
+    
+    return
+
+# Function to capture one band and detect its peaks, returns everything needed to record the result
+# with switch=False the device is taken to have its own antenna and the antenna switch is left alone
+def band_capture(session, gps, band, switch=True):
+    
+    # Set frequency of interest and display in MHz
+    freq = band['freq']
     freq_mhz = freq/1000000
-    num_avg = 100
-    num_samples = 5000
-    print("Sampling at %.2f MHz\n" % freq_mhz)
+    print("Sampling at %.3f MHz\n" % freq_mhz)
     
-    # Activate 70MHz antenna
-    gpio_switch(18,1)
+    # Activate the band's antenna, retuning while the switch settles
+    settled = time.time()
+    if switch:
+        settled = gpio_switch(band['pin'],1,wait=False)
     
-    #RTL re-connections counter
-    i = 1
+    # Tune SDR
+    with stages.time('retune'):
+        sdr = session.tune(freq)
     
-    # Set up SDR
-    sdr, flag = sdr_control(freq,i,flag)
+    with stages.time('settle'):
+        sleep_until(settled)
     
-    # Find current GPS Location
-    lon, lat, alt = gps_loc()
+    # averages are only chosen by the tolerance for full band captures
+    adaptive = band['tolerance'] is not None and band['zoom'] is None
+    
+    # Start recording the raw samples if required, tagged with the latest GPS fix
+    # an adaptive capture reads its blocks in the same way as a batch of the averages it used
+    recorder = None
+    if band['record_iq']:
+        lon, lat, alt = gps.position()
+        settings = {'num_avg': band['num_avg'], 'num_samples': band['num_samples'], 'mode': 'batch' if adaptive else band['mode'], 'overlap': band['overlap'], 'window': band['window'],
+                    'zoom': band['zoom'], 'target_freq': freq, 'tolerance': band['tolerance'] if adaptive else None}
+        recorder = iq_start(freq_mhz, sdr, lon, lat, alt, settings)
+    
+    # Keep the raw samples for the channelizer if required
+    tap = recorder
+    if band['channels'] is not None:
+        tap = CaptureTap(recorder)
     
     # Collect Data 
-    spectrum, faxis,samples = data(sdr, num_avg, num_samples)
+    capture_start = time.time()
+    if not adaptive:
+        spectrum, faxis,samples = data(sdr, band['num_avg'], band['num_samples'], band['mode'], recorder=tap, zoom=band['zoom'], target_freq=freq, overlap=band['overlap'], window=band['window'])
+        used = band['num_avg']
+    else:
+        spectrum, faxis,samples, used = adaptive_data(sdr, band['num_avg'], band['num_samples'], freq, band['tolerance'], recorder=tap)
+    capture_end = time.time()
+    
+    # Find GPS Location at the middle of the capture
+    with stages.time('gps'):
+        lon, lat, alt = gps.position_at((capture_start + capture_end) / 2)
+    
+    # the averages used are recorded in place of the most allowed
+    if recorder is not None:
+        recorder.close({'num_avg': used, 'max_avg': band['num_avg']})
+        
+        # a capture that read nothing leaves no recording to replay or index
+        if recorder.num_bytes == 0:
+            recorder.remove()
+            recorder = None
+    
+    # Deactivate the band's antenna, the next antenna's settling time covers this
+    if switch:
+        gpio_switch(band['pin'],0,settle=0)
     
     # Detect Peaks   
-    amp_peak_1, freq_peak_1, amp_peak_2, freq_peak_2, amp_peak_3, freq_peak_3, amp_peak_4, freq_peak_4, amp_peak_5, freq_peak_5, indexes = peak_det(spectrum, faxis, freq_mhz)
+    with stages.time('peak_det'):
+        peaks = peak_det(spectrum, faxis, freq_mhz, band['detector'], band['cfar'])
+    
+    # Measure every channel of interest from the same capture, a capture that failed has nothing to measure
+    measured = None
+    if band['channels'] is not None:
+        raw = tap.raw()
+        if len(raw) == 0:
+            print("No Samples Captured, Channels at %.3f MHz Not Measured\n" % freq_mhz)
+        else:
+            with stages.time('channelize'):
+                measured = get_channelizer(band['num_channels'], sdr.sample_rate, sdr.center_freq).measure(raw, band['channels'])
     
     # Get current time and date    
     current_date, current_hour, current_time, time_for_save = time_date()
     
+    # the tuning is kept with the result, as the device may be retuned before it is recorded
+    return {'band': band, 'freq_mhz': freq_mhz, 'center_freq': sdr.center_freq, 'sample_rate': sdr.sample_rate, 'spectrum': spectrum, 'faxis': faxis, 'peaks': peaks, 'channels': measured,
+            'date': current_date, 'hour': current_hour, 'position': (lon, lat, alt), 'iq': recorder.name if recorder is not None else None, 'num_avg': used}
+
+# Function to save, log and index the result of one band_capture()
+def band_record(results, store, index, channel_results, capture):
+    
+    band = capture['band']
+    lon, lat, alt = capture['position']
+    
     # Save the sampled data for later use if needed 
-    raw_save(time_for_save,freq_mhz,sdr.sample_rate, spectrum)
+    with stages.time('raw_save'):
+        archive, row = raw_save(store, capture['freq_mhz'], capture['center_freq'], capture['sample_rate'], capture['spectrum'], band['zoom'], capture['faxis'])
     
     # Record results
-    display_write(current_date, current_hour, amp_peak_1, freq_peak_1, amp_peak_2, freq_peak_2, amp_peak_3, freq_peak_3, amp_peak_4, freq_peak_4, amp_peak_5, freq_peak_5, lon, lat, alt)
+    with stages.time('display_write'):
+        display_write(results, capture['date'], capture['hour'], *(capture['peaks'][:10] + (lon, lat, alt)))
+    
+    if capture['channels'] is not None:
+        channel_write(channel_results, capture['date'], capture['hour'], band['channels'], *(capture['channels'] + (lon, lat, alt)))
+    
+    # Record where the data for this result is stored and the averages it took
+    index.add(capture['date'], capture['hour'], capture['freq_mhz'], archive, row, capture['iq'], capture['num_avg'])
+    
+    return
+
+## Main Body ##
+
+# Get Location
+def test(session, results, store, index, gps, channel_results):
+    
+    #start_time = time.time()
+    #print("--- %s seconds ---" % (time.time() - start_time))
+    
+    # Set up GPIO
+    gpio_set()
+    
+    # Take each band in turn on the one device, switching antennas between them
+    captures = []
+    for band in bands:
+        capture = band_capture(session, gps, band)
+        band_record(results, store, index, channel_results, capture)
+        captures.append(capture)
+    
+    index.commit()
     
+    # Flash status lights to indicate successful completion
+    gpio_switch([22,24,26],1,settle=0.1)
+    gpio_switch([22,24,26],0,settle=0)
+    
+    # GPIO disconnect
     try:
-        # Disconnect SDR
-        sdr.close()
-        
+        gpio.cleanup()
     except:
+        print("GPIO Not Deactivated")
         
-        print('\nFailed to Close RTL SDR\n' )
+    # Plot FFT's, the graph shows the first two bands so is only drawn when there are two
+    if len(captures) >= 2:
+        first, second = captures[0], captures[1]
+        debug_graph(first['faxis'], first['spectrum'], first['peaks'][10], first['peaks'][0], first['peaks'][1], first['peaks'][8], second['faxis'], second['spectrum'], second['peaks'][10], second['peaks'][0], second['peaks'][1], second['peaks'][8])
+    
+    return session.flag
+
+# Function to capture each of a device's bands in turn, run on the device's own thread
+# captures are put on the shared queue as they finish, followed by None once the device is done
+def device_capture(session, gps, device_bands, captures):
+    
+    try:
+        for band in device_bands:
+            captures.put(band_capture(session, gps, band, switch=False))
+    
+    except BaseException as error:
+        # a device that cannot be reached only loses its own bands
+        print("Capture Failed on Device %s: %s\n" % (device_bands[0]['device'], error))
     
-    # Deactivate 70MHz antenna
-    gpio_switch(18,0)
+    finally:
+        captures.put(None)
+    
+    return
+
+# Class running one device's captures on a thread of its own that lasts for the whole run
+# the thread keeps its own work buffers, so they are allocated once and never shared with another device
+class CaptureWorker:
+    
+    def __init__(self, session, gps, device_bands):
+        
+        self.session = session
+        self.gps = gps
+        self.device_bands = device_bands
         
-    # Taking second sample
+        # each cycle's queue for the captures, None stops the thread
+        self.tasks = queue.Queue()
+        
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
     
-    # Set second frequency of interest and display in MHz
-    freq = 869.525e6
-    freq_mhz = freq/1000000
-    num_avg = 100
-    num_samples = 5000
-    print("Sampling at %.3f MHz\n" % freq_mhz)
+    # Function to capture the device's bands each time a cycle is started
+    def run(self):
+        
+        while True:
+            captures = self.tasks.get()
+            
+            if captures is None:
+                break
+            
+            device_capture(self.session, self.gps, self.device_bands, captures)
+        
+        return
     
-    # Activate 868MHz antenna
-    gpio_switch(16,1)
+    # Function to start capturing the device's bands, the captures are put on the given queue
+    def capture(self, captures):
+        
+        self.tasks.put(captures)
     
-    #RTL re-connections counter
-    i = 1
+    # Function to stop the thread once any capture under way has finished
+    def stop(self):
+        
+        self.tasks.put(None)
+        self.thread.join()
+
+# Function to capture the bands on several devices at once, each device with its own antenna and thread
+# workers holds a capture worker for each device, results are recorded as they arrive
+def parallel_test(workers, results, store, index, gps, channel_results):
+    
+    captures = queue.Queue()
+    
+    # the reads and FFTs release the interpreter so the devices run side by side
+    for worker in workers:
+        worker.capture(captures)
+    
+    # files and the index are only written from this thread
+    finished = 0
+    while finished < len(workers):
+        capture = captures.get()
+        if capture is None:
+            finished += 1
+        else:
+            band_record(results, store, index, channel_results, capture)
     
-    # Setup SDR
-    sdr, flag = sdr_control(freq,i,flag)
+    index.commit()
     
-    # Find current GPS Location
-    lon, lat, alt = gps_loc()
+    return any(worker.session.flag for worker in workers)
+
+# Function to monitor one band without stopping, keeping a running average of every bin and recording a result every interval seconds
+# method is 'exponential', weighting each block by alpha, or 'sliding', the mean of the last length blocks
+# blocks are read chunk at a time on a reader thread, only returns if the device fails
+def monitor(session, results, store, index, gps, band, interval=10.0, method='exponential', alpha=0.05, length=400, chunk=20, num_buffers=4):
     
-    # Collect Data 
-    spectrum2, faxis2,samples2 = data(sdr, num_avg, num_samples)
+    freq = band['freq']
+    freq_mhz = freq/1000000
+    num_samples = band['num_samples']
+    print("Monitoring %.3f MHz\n" % freq_mhz)
     
-    # Detect Peaks   
-    amp_peak_12, freq_peak_12, amp_peak_22, freq_peak_22, amp_peak_32, freq_peak_32, amp_peak_42, freq_peak_42, amp_peak_52, freq_peak_52, indexes2 = peak_det(spectrum2, faxis2, freq_mhz)
+    # Activate the band's antenna, retuning while the switch settles
+    gpio_set()
+    settled = gpio_switch(band['pin'],1,wait=False)
     
-    # Get current time and date     
-    current_date, current_hour, current_time, time_for_save = time_date()
+    with stages.time('retune'):
+        sdr = session.tune(freq)
     
-    # Save the sampled data for later use if needed 
-    raw_save(time_for_save,freq_mhz,sdr.sample_rate,spectrum2)
+    sleep_until(settled)
     
-    # Record results
-    display_write(current_date, current_hour, amp_peak_12, freq_peak_12, amp_peak_22, freq_peak_22, amp_peak_32, freq_peak_32, amp_peak_42, freq_peak_42, amp_peak_52, freq_peak_52, lon, lat, alt)
+    # ring of raw buffers, FFT buffers and the running average are allocated once for the whole run
+    plan = get_plan(num_samples, sdr.sample_rate, sdr.center_freq)
+    ring = numpy.zeros((num_buffers, 2 * chunk * num_samples), dtype=numpy.uint8)
+    block, power = plan.batch_buffers(chunk)
+    running = RunningSpectrum(num_samples, method, alpha, length)
+    
+    # queues of buffer indexes waiting to be filled and waiting to be processed
+    free = queue.Queue()
+    full = queue.Queue()
+    for buffer in range(num_buffers):
+        free.put(buffer)
+    
+    status = {'error': False, 'stop': False}
+    
+    reader = threading.Thread(target=stream_read, args=(sdr, None, chunk * num_samples, ring, free, full, status))
+    reader.daemon = True
+    reader.start()
+    
+    last_result = time.time()
+    next_result = last_result + interval
+    blocks = 0
     
     try:
-        # Disconnect SDR
-        sdr.close()
+        while True:
+            buffer = full.get()
+            
+            # reader has failed, close the device so it is reopened next time
+            if buffer is None:
+                print("RTL SDR Communication Error During Monitoring\n")
+                session.close()
+                break
+            
+            with stages.time('fft'):
+                # convert to samples with one row per FFT
+                bytes_to_iq(ring[buffer], block.reshape(-1))
+                
+                # the raw bytes have been used, return the buffer to the reader
+                free.put(buffer)
+                
+                # take fft of every windowed row at once, with the same scaling as fft()
+                block *= plan.window
+                fft = numpy.fft.fft(block, axis=1)
+                fft_power(fft, power)
+                
+                running.update(power)
+            
+            blocks += chunk
+            
+            now = time.time()
+            if now < next_result:
+                continue
+            
+            # Detect Peaks in the running average, shifted so Fc is at the centre
+            spectrum = numpy.fft.fftshift(running.spectrum())
+            
+            with stages.time('peak_det'):
+                amp_peak_1, freq_peak_1, amp_peak_2, freq_peak_2, amp_peak_3, freq_peak_3, amp_peak_4, freq_peak_4, amp_peak_5, freq_peak_5, indexes = peak_det(spectrum, plan.faxis, freq_mhz, band['detector'], band['cfar'])
+            
+            lon, lat, alt = gps.position_at(now)
+            current_date, current_hour, current_time, time_for_save = time_date()
+            
+            # Save, record and index the result in the same way as test()
+            with stages.time('raw_save'):
+                archive, row = raw_save(store, freq_mhz, sdr.center_freq, sdr.sample_rate, spectrum)
+            
+            with stages.time('display_write'):
+                display_write(results, current_date, current_hour, amp_peak_1, freq_peak_1, amp_peak_2, freq_peak_2, amp_peak_3, freq_peak_3, amp_peak_4, freq_peak_4, amp_peak_5, freq_peak_5, lon, lat, alt)
+            
+            index.add(current_date, current_hour, freq_mhz, archive, row)
+            index.commit()
+            
+            # share of the time since the last result that was captured and processed, below 100% samples were dropped
+            print("%.1f%% of the Last %.1f Seconds Processed\n" % (100 * blocks * num_samples / (sdr.sample_rate * (now - last_result)), now - last_result))
+            
+            blocks = 0
+            last_result = now
+            next_result = max(next_result + interval, now)
+            
+            stages.report()
+    
+    finally:
+        # stop the reader, handing it a buffer in case it is waiting for one
+        status['stop'] = True
+        free.put(0)
+        reader.join()
         
-    except:
+        gpio_switch(band['pin'],0,settle=0)
+    
+    return session.flag
+
+# Function to hop the tuner across start_freq to stop_freq and stitch the hops in to one spectrum
+# returns the stitched spectrum and its frequency axis in MHz
+def sweep(session, start_freq, stop_freq, num_avg, num_samples, overlap=0.25, edge=0.1, reverse=False, settled=None):
+    
+    sample_rate = 2.048e6
+    centers = sweep_centers(start_freq, stop_freq, sample_rate, num_samples, overlap, edge)
+    
+    # every hop takes the same time, so the length of a sweep is known before it starts
+    hop_time = (session.settle_samples + num_avg * num_samples) / sample_rate
+    print("Sweeping %.3f to %.3f MHz in %d Hops, Expected to Take %.1f Seconds\n" % (start_freq/1000000, stop_freq/1000000, len(centers), len(centers) * hop_time))
+    
+    # sweep up and down on alternate cycles so the tuner never jumps back across the whole range
+    order = numpy.arange(len(centers))
+    if reverse:
+        order = order[::-1]
+    
+    spectra = numpy.zeros((len(centers), num_samples))
+    start_time = time.time()
+    
+    for hop in order:
+        
+        # tuning adds 0.1 MHz to the frequency asked for
+        with stages.time('retune'):
+            sdr = session.tune(centers[hop] - 0.1e6)
         
-        print('\nFailed to Close RTL SDR\n' )
+        # first hop waits for the antenna switch
+        if settled is not None:
+            with stages.time('settle'):
+                sleep_until(settled)
+            settled = None
         
+        spectra[hop], faxis, spectrumA = data(sdr, num_avg, num_samples)
     
-    # Deactivate 868MHz antenna
-    gpio_switch(16,0)
+    print("Sweep Complete in %.1f Seconds\n" % (time.time() - start_time))
     
-    # Flash status lights to indicate successful completion
-    gpio_switch([22,24,26],1)
-    gpio_switch([22,24,26],0)
+    with stages.time('stitch'):
+        spectrum, faxis = stitch(spectra, centers, sample_rate, start_freq, stop_freq, edge)
+    
+    return spectrum, faxis
+
+# Function to sweep one range in place of the two fixed bands, logging and storing the stitched spectrum
+# results are written to their own logs by sweep_results, so they are not taken for results of the fixed bands
+def sweep_test(session, sweep_results, store, index, gps, start_freq, stop_freq, pin, reverse=False):
+    
+    # Set up GPIO
+    gpio_set()
+    
+    num_avg = 100
+    num_samples = 5000
+    # peak detector for the stitched spectrum, 'threshold', 'cfar_ca' or 'cfar_os'
+    detector = 'cfar_ca'
+    # the range is stored and indexed by its centre
+    freq_mhz = (start_freq + stop_freq) / 2000000
+    
+    # Activate antenna for the range, the first retune happens while the switch settles
+    settled = gpio_switch(pin,1,wait=False)
+    
+    # Collect Data
+    capture_start = time.time()
+    spectrum, faxis = sweep(session, start_freq, stop_freq, num_avg, num_samples, reverse=reverse, settled=settled)
+    capture_end = time.time()
+    
+    # Find GPS Location at the middle of the sweep
+    with stages.time('gps'):
+        lon, lat, alt = gps.position_at((capture_start + capture_end) / 2)
+    
+    # Detect Peaks, the range has no frequency of interest so peak 1 is the strongest peak found
+    with stages.time('peak_det'):
+        amps, freqs, indexes = peak_det_batch(spectrum, faxis, freq_mhz, detector)
+        amps, freqs = strongest_first(spectrum, faxis, amps, freqs)
+    
+    # Get current time and date
+    current_date, current_hour, current_time, time_for_save = time_date()
+    
+    # Save the stitched spectrum, its centre and width take the place of the tuning so the axis can be rebuilt with get_plan()
+    with stages.time('raw_save'):
+        width = len(spectrum) * (faxis[1] - faxis[0]) * 1000000
+        archive, row = store.append(freq_mhz, spectrum, time.time(), start_freq + width / 2, width, 'sweep-%d' % len(spectrum))
+        print ('%s row %d saved \n' % (archive, row))
+    
+    # Record results
+    with stages.time('display_write'):
+        display_write(sweep_results, current_date, current_hour, amps[0, 0], freqs[0, 0], amps[0, 1], freqs[0, 1], amps[0, 2], freqs[0, 2], amps[0, 3], freqs[0, 3], amps[0, 4], 'noise', lon, lat, alt)
+    
+    index.add(current_date, current_hour, freq_mhz, archive, row)
+    index.commit()
+    
+    # Deactivate antenna
+    gpio_switch(pin,0,settle=0)
     
     # GPIO disconnect
     try:
         gpio.cleanup()
     except:
         print("GPIO Not Deactivated")
-        
-    # Plot FFT's    
-    debug_graph(faxis,spectrum,indexes, amp_peak_1, freq_peak_1,amp_peak_5,faxis2,spectrum2,indexes2, amp_peak_12, freq_peak_12,amp_peak_52)
     
-    return flag
+    return session.flag
 
 #THIS PART ACTUALLY MAKES IT RUN#
 
-# Schedule test to run every X minutes
-#schedule.every(0.1).minutes.do(test)
+# only run when started as a programme, so the functions can be imported for testing and benchmarking
+if __name__ == '__main__':
+    
+    # run on a simulated device, for use without a dongle
+    if '--simulate' in sys.argv:
+        RtlSdr = SimulatedRtlSdr
 
-# Attempt to connect to GPS device
-try:
-    # Connect to the local gpsd
-    gpsd.connect()
+    # refuse band settings that cannot be captured as given
+    for band in bands:
+        band_check(band)
 
-# If device is unavailable, alert user.
-except:
-    print('GPS Not Available on This Device')
+    # Schedule test to run every X minutes
+    #schedule.every(0.1).minutes.do(test)
 
-flag = False
+    # GPS is read on its own thread so captures never wait on gpsd
+    gps = GpsService()
+    gps.start()
 
-# set up never ending loop
-while True:
-    # Check for pending tasks
-    #schedule.run_pending()
-    # Run test programme
-    
-    flag = test(flag)
+    # SDR device stays open between cycles and is retuned for each band
+    session = SdrSession()
+
+    # log files stay open and are written in blocks
+    results = ResultWriter([TextSink('log.txt'), CsvSink('log.csv'), BinarySink('log.bin')])
+
+    # power, peak and noise of each channel measured by the channelizer
+    channel_results = ResultWriter([CsvSink('channels.csv')])
+
+    # spectra are appended to one archive per band per day
+    store = SpectrumStore()
+
+    # index from each logged result to its stored spectrum and raw samples
+    index = CaptureIndex()
+
+    # a cycle is started every X seconds however long the measurements take
+    scheduler = CycleScheduler(period=10)
+    
+    # capture each band on its own device at once, as given by the band's device setting, in place of switching antennas on one device
+    multi_device = False
+    
+    # one session and capture thread per device when capturing at once
+    sessions = dict()
+    workers = []
+    if multi_device:
+        for band in bands:
+            if band['device'] not in sessions:
+                sessions[band['device']] = SdrSession(device=band['device'])
+        for device, device_session in sessions.items():
+            workers.append(CaptureWorker(device_session, gps, [band for band in bands if band['device'] == device]))
+    
+    # set to a band's position in bands to monitor it without stopping in place of the cycles, e.g. 1 for 869.525MHz
+    # a result is recorded every cycle period from a running average, 'exponential' or 'sliding'
+    monitor_band = None
+    monitor_method = 'exponential'
+    
+    # set to (start, stop) in Hz to sweep a range each cycle in place of the two fixed bands, e.g. (860e6, 885e6)
+    sweep_range = None
+    # antenna used for the sweep, 18 for 70MHz and 16 for 868MHz
+    sweep_pin = 16
+    
+    # sweeps are logged apart from the fixed bands
+    sweep_results = None
+    if sweep_range is not None:
+        sweep_results = ResultWriter([TextSink('sweep_log.txt'), CsvSink('sweep_log.csv'), BinarySink('sweep_log.bin')])
+
+    # set up never ending loop
+    try:
+        while True:
+            # Check for pending tasks
+            #schedule.run_pending()
+            # Wait for the start of the next cycle
+            scheduler.wait()
         
-   
-    if flag == True:
-        print('\nThis Device Has Recovered From a Communication Error\n' )
-    
-    if flag == False:
-        print('\nThis Device Has Not Recovered From a Communication Error\n' )
-    
-    # Wait X seconds before next loop
-    time.sleep(5)
-    
\ No newline at end of file
+            # Run test programme
+            if monitor_band is not None:
+                flag = monitor(session, results, store, index, gps, bands[monitor_band], interval=scheduler.period, method=monitor_method)
+            elif multi_device:
+                flag = parallel_test(workers, results, store, index, gps, channel_results)
+            elif sweep_range is None:
+                flag = test(session, results, store, index, gps, channel_results)
+            else:
+                flag = sweep_test(session, sweep_results, store, index, gps, sweep_range[0], sweep_range[1], sweep_pin, reverse=scheduler.cycles % 2 == 1)
+            
+       
+            if flag == True:
+                print('\nThis Device Has Recovered From a Communication Error\n' )
+        
+            if flag == False:
+                print('\nThis Device Has Not Recovered From a Communication Error\n' )
+        
+            # Record how long the cycle took
+            scheduler.done()
+        
+            # write the stage timings to metrics.prom every minute
+            stages.report()
+
+    finally:
+        # Disconnect SDR, once each device's thread has finished with it
+        session.close()
+        for worker in workers:
+            worker.stop()
+        for device_session in sessions.values():
+            device_session.close()
+    
+        # write any buffered results
+        results.close()
+        channel_results.close()
+        if sweep_results is not None:
+            sweep_results.close()
+        store.close()
+        index.close()
+        gps.stop()
+        stages.export()
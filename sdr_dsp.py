@@ -0,0 +1,672 @@
+'''
+Spectral processing shared by the capture programme and the analysis scripts
+'''
+
+import numpy
+import threading
+from collections import OrderedDict
+from sdr_metrics import stages
+
+# maximum number of plans kept, the least recently used plan is dropped first
+# plans hold no work buffers, so enough are kept for every hop of a sweep
+max_plans = 64
+
+# plans keyed by (num_samples, sample_rate, center_freq, window), zoom plans by ('zoom', num_samples, sample_rate, center_freq, target_freq, decimation, window)
+# and channelizers by ('channels', num_channels, sample_rate, center_freq, taps_per_channel)
+plans = OrderedDict()
+
+# windows keyed by (window, num_samples), shared by the plans of every band
+windows = dict()
+
+# held while the plans and windows are looked up or added, so capture threads on several devices can share them
+# reentrant as a zoom plan fetches a plan while it is made
+plans_lock = threading.RLock()
+
+# work buffers keyed by (name, shape), one set for each thread, shared by the plans of every band with the same FFT size and number of averages
+buffers = threading.local()
+
+# Function to create a window of the given type, None gives no window
+def make_window(window, num_samples):
+
+    if window is None:
+        return numpy.ones(num_samples)
+
+    elif window == 'hamming':
+        return numpy.hamming(num_samples)
+
+    elif window == 'hanning':
+        return numpy.hanning(num_samples)
+
+    elif window == 'blackman':
+        return numpy.blackman(num_samples)
+
+    elif window == 'bartlett':
+        return numpy.bartlett(num_samples)
+
+    else:
+        raise ValueError("Unknown window: %s" % window)
+
+# Function to return a window of the given type, only made once for each type and size
+def get_window(window, num_samples):
+
+    key = (window, num_samples)
+
+    with plans_lock:
+        if key not in windows:
+            window_values = make_window(window, num_samples)
+
+            # the window is shared, so it must never be changed in place
+            window_values.flags.writeable = False
+            windows[key] = window_values
+
+        return windows[key]
+
+# Function to return a work buffer of the given shape, allocated on first use by each thread and reused after
+# every thread has its own buffers, so devices captured at once never write over each other's samples
+def work_buffer(name, shape, dtype=numpy.complex128):
+
+    if not hasattr(buffers, 'arrays'):
+        buffers.arrays = dict()
+
+    key = (name, shape)
+
+    if key not in buffers.arrays:
+        buffers.arrays[key] = numpy.zeros(shape, dtype=dtype)
+
+    return buffers.arrays[key]
+
+# Function to pass the raw bytes of a capture to the recorder, if the capture is being recorded
+def record_raw(recorder, raw):
+
+    if recorder is not None:
+        with stages.time('record'):
+            recorder.write(raw)
+
+    return
+
+# Function to find the power in each bin of an FFT, written in to power, with the |2X|^2 scaling that fft() gives its amplitudes
+def fft_power(fft, power):
+
+    numpy.abs(fft, out=power)
+    power **= 2
+    power *= 4
+
+    return power
+
+# Class holding the window and frequency axis for one FFT size at one band, with access to the work buffers for its size
+class SpectralPlan:
+
+    def __init__(self, num_samples, sample_rate, center_freq, window='hamming'):
+
+        self.num_samples = num_samples
+        self.sample_rate = sample_rate
+        self.center_freq = center_freq
+
+        self.window = get_window(window, num_samples)
+
+        # create frequency axis in MHz, noting that Fc is in centre
+        fstep = sample_rate/num_samples # fft bin size
+        fstep = fstep / 1000000 #  convert to MHz
+        self.faxis = ((center_freq/1000000)-(fstep*(num_samples/2))) + numpy.arange(num_samples) * fstep
+
+    # Function to return the work buffers for single block processing, the samples of one block and a power sum
+    def block_buffers(self):
+
+        return work_buffer('iq', (self.num_samples,)), work_buffer('power_avg', (self.num_samples,), numpy.float64)
+
+    # Function to return work buffers for a batch of num_avg blocks
+    def batch_buffers(self, num_avg):
+
+        return work_buffer('block', (num_avg, self.num_samples)), work_buffer('block_power', (num_avg, self.num_samples), numpy.float64)
+
+    # Function to return a ring of raw 8 bit I/Q buffers for streaming capture
+    def ring_buffers(self, num_buffers):
+
+        return work_buffer('ring', (num_buffers, 2 * self.num_samples), numpy.uint8)
+
+    # Function to return a buffer for length contiguous samples, the overlapped segments are views of it
+    def sample_buffer(self, length):
+
+        return work_buffer('samples', (length,))
+
+# Class keeping a running average of the power in every bin, updated with each batch of blocks as they are captured
+# method is 'exponential', where each block is weighted by alpha, or 'sliding', the mean of the last length blocks
+# every buffer is allocated once, so the average can run for as long as the capture does
+class RunningSpectrum:
+
+    def __init__(self, num_bins, method='exponential', alpha=0.05, length=400):
+
+        if method not in ('exponential', 'sliding'):
+            raise ValueError("Unknown averaging method: %s" % method)
+
+        self.method = method
+        self.alpha = alpha
+        self.length = length
+
+        self.average = numpy.zeros(num_bins)
+        # blocks averaged so far
+        self.count = 0
+
+        # the last length blocks and their sum, for the sliding average
+        if method == 'sliding':
+            self.history = numpy.zeros((length, num_bins))
+            self.total = numpy.zeros(num_bins)
+            self.position = 0
+
+    # Function to add a batch of power spectra, one row per block
+    def update(self, power):
+
+        if self.method == 'exponential':
+
+            # the first block starts the average, rather than averaging up from zero
+            if self.count == 0:
+                self.average[:] = power[0]
+                self.count = 1
+                power = power[1:]
+
+            # applying the average to each row in turn is one weighted sum over the batch
+            rows = len(power)
+            weights = self.alpha * (1 - self.alpha)**numpy.arange(rows - 1, -1, -1)
+            self.average *= (1 - self.alpha)**rows
+            self.average += weights @ power
+
+        else:
+            for row in power[-self.length:]:
+                self.total -= self.history[self.position]
+                self.history[self.position] = row
+                self.total += row
+                self.position = (self.position + 1) % self.length
+
+                # sum again once per lap of the history so rounding errors cannot build up
+                if self.position == 0:
+                    numpy.sum(self.history, axis=0, out=self.total)
+
+            numpy.divide(self.total, min(self.count + len(power), self.length), out=self.average)
+
+        self.count += len(power)
+
+        return
+
+    # Function to return the running average in dB
+    def spectrum(self):
+
+        return 10 * numpy.log10(self.average)
+
+# Class putting a mixer and a decimating filter in front of an FFT of num_samples, so the FFT only covers sample_rate/decimation around target_freq
+# only the central half of the zoomed spectrum, where the filter is flat and free of aliases, is kept
+class ZoomPlan:
+
+    # output samples each filter spans
+    filter_span = 8
+
+    def __init__(self, num_samples, sample_rate, center_freq, target_freq, decimation, window='hamming'):
+
+        self.num_samples = num_samples
+        self.decimation = decimation
+
+        self.window = get_window(window, num_samples)
+
+        # bins kept from the unshifted FFT, fftshift() puts them in order with target_freq in the centre
+        quarter = num_samples // 4
+        self.kept = numpy.r_[0:quarter, num_samples - quarter:num_samples]
+
+        # frequency axis of the kept bins in MHz, in the same form as a plan's
+        fstep = sample_rate / decimation / num_samples
+        self.faxis = get_plan(2 * quarter, 2 * quarter * fstep, target_freq, None).faxis
+
+        # low pass filter cutting off at half the decimated sample rate, a hamming windowed sinc
+        num_taps = self.filter_span * decimation
+        k = numpy.arange(num_taps) - (num_taps - 1) / 2
+        taps = numpy.sinc(k / decimation) * numpy.hamming(num_taps)
+        taps /= taps.sum()
+
+        # the mixer moving target_freq to 0 Hz is split between the taps and a rotation at the output rate
+        shift = -2 * numpy.pi * (target_freq - center_freq) / sample_rate
+        taps = taps * numpy.exp(1j * shift * numpy.arange(num_taps))
+        self.rotation = numpy.exp(1j * shift * decimation * numpy.arange(num_samples))
+
+        # the taps work on the raw interleaved bytes, giving the real and imaginary parts of each output
+        # the conversion of bytes to samples, x/127.5 - (1+1j), becomes a scale on the taps and a fixed offset
+        weights = numpy.zeros((num_taps, 2, 2))
+        weights[:, 0, 0] = taps.real
+        weights[:, 0, 1] = taps.imag
+        weights[:, 1, 0] = -taps.imag
+        weights[:, 1, 1] = taps.real
+        self.weights = (weights / 127.5).reshape(self.filter_span, 2 * decimation, 2).astype(numpy.float32)
+        self.offset = -(1 + 1j) * taps.sum()
+
+        # samples read for each block, enough for every output sample to have a full filter
+        self.input_samples = (num_samples + self.filter_span - 1) * decimation
+
+    # Function to mix, filter and decimate raw bytes holding num_avg blocks, returns one row of complex samples per block
+    # each group of decimation samples is multiplied by one row of weights, so the filter is only worked out at the output rate
+    def decimate(self, raw, num_avg):
+
+        raw = numpy.frombuffer(raw, dtype=numpy.uint8, count=2 * num_avg * self.input_samples)
+        frames = raw.astype(numpy.float32).reshape(num_avg, -1, 2 * self.decimation)
+
+        out = frames[:, :self.num_samples] @ self.weights[0]
+        for q in range(1, self.filter_span):
+            out += frames[:, q:q + self.num_samples] @ self.weights[q]
+
+        return (out[..., 0] + 1j * out[..., 1] + self.offset) * self.rotation
+
+# Class splitting a capture in to num_channels evenly spaced channels with a polyphase filter bank
+# each channel is sample_rate/num_channels wide and sampled at that rate, channel k is centred k channels above center_freq
+class Channelizer:
+
+    def __init__(self, num_channels, sample_rate, center_freq, taps_per_channel=8):
+
+        self.num_channels = num_channels
+        self.sample_rate = sample_rate
+        self.center_freq = center_freq
+        self.taps_per_channel = taps_per_channel
+
+        # prototype low pass filter one channel wide, a hamming windowed sinc, unity gain so a tone keeps its amplitude
+        n = numpy.arange(num_channels * taps_per_channel) - (num_channels * taps_per_channel - 1) / 2
+        prototype = numpy.sinc(n / num_channels) * numpy.hamming(num_channels * taps_per_channel)
+        prototype /= prototype.sum()
+
+        # one row of the filter for each block of num_channels samples it spans
+        self.weights = prototype.reshape(taps_per_channel, num_channels)
+
+        # centre of each channel in MHz, in FFT order
+        self.freqs = (center_freq + numpy.fft.fftfreq(num_channels, 1 / sample_rate)) / 1000000
+
+    # Function to find the channel nearest each frequency in MHz
+    def channel_index(self, freqs_mhz):
+
+        offsets = (numpy.asarray(freqs_mhz) * 1000000 - self.center_freq) * self.num_channels / self.sample_rate
+
+        return numpy.round(offsets).astype(int) % self.num_channels
+
+    # Function to split complex samples in to channels, returns one row per output sample and one column per channel
+    def split(self, samples):
+
+        frames = samples[:len(samples) - len(samples) % self.num_channels].reshape(-1, self.num_channels)
+        num_frames = len(frames) - self.taps_per_channel + 1
+
+        # weight and sum the blocks each output spans, then one FFT per output separates the channels
+        summed = frames[:num_frames] * self.weights[0]
+        for p in range(1, self.taps_per_channel):
+            summed += frames[p:p + num_frames] * self.weights[p]
+
+        return numpy.fft.fft(summed, axis=1)
+
+    # Function to measure channels from the raw 8 bit I/Q bytes of a capture
+    # returns the centre of the channel used for each frequency in MHz, and its mean power, peak power and noise in dB relative to full scale
+    # noise is taken from the median power, which bursts hardly move, scaled to the mean of noise alone
+    # frequencies outside the capture are returned as nan
+    def measure(self, raw, freqs_mhz):
+
+        # every output needs taps_per_channel blocks of num_channels samples
+        if len(raw) // 2 < self.num_channels * self.taps_per_channel:
+            raise ValueError("Too few samples to measure channels: %d, at least %d needed" % (len(raw) // 2, self.num_channels * self.taps_per_channel))
+
+        samples = bytes_to_iq(raw, numpy.zeros(len(raw) // 2, dtype=numpy.complex128))
+
+        channels = self.channel_index(freqs_mhz)
+        outputs = self.split(samples)[:, channels]
+        power = outputs.real**2 + outputs.imag**2
+
+        mean_db = 10 * numpy.log10(numpy.mean(power, axis=0))
+        peak_db = 10 * numpy.log10(numpy.max(power, axis=0))
+        noise_db = 10 * numpy.log10(numpy.median(power, axis=0) / numpy.log(2))
+
+        # frequencies outside the captured band have no channel
+        outside = numpy.abs(numpy.asarray(freqs_mhz) * 1000000 - self.center_freq) > self.sample_rate / 2
+        centres = numpy.where(outside, numpy.nan, self.freqs[channels])
+        mean_db[outside] = numpy.nan
+        peak_db[outside] = numpy.nan
+        noise_db[outside] = numpy.nan
+
+        return centres, mean_db, peak_db, noise_db
+
+# Function to fetch the plan for key from the cache, made by factory if it has not been used recently
+def cached(key, factory):
+
+    with plans_lock:
+        plan = plans.get(key)
+
+        if plan is None:
+            plan = factory()
+            plans[key] = plan
+
+            # drop the oldest plan once the cache is full
+            if len(plans) > max_plans:
+                plans.popitem(last=False)
+
+        else:
+            plans.move_to_end(key)
+
+        return plan
+
+# Function to fetch a channelizer from the plan cache, creating it if it has not been used recently
+def get_channelizer(num_channels, sample_rate, center_freq, taps_per_channel=8):
+
+    key = ('channels', num_channels, sample_rate, center_freq, taps_per_channel)
+
+    return cached(key, lambda: Channelizer(num_channels, sample_rate, center_freq, taps_per_channel))
+
+# Function to fetch a plan from the cache, creating it if it has not been used recently
+def get_plan(num_samples, sample_rate, center_freq, window='hamming'):
+
+    key = (num_samples, sample_rate, center_freq, window)
+
+    return cached(key, lambda: SpectralPlan(num_samples, sample_rate, center_freq, window))
+
+# Function to fetch a zoom plan from the cache, creating it if it has not been used recently
+def get_zoom_plan(num_samples, sample_rate, center_freq, target_freq, decimation, window='hamming'):
+
+    key = ('zoom', num_samples, sample_rate, center_freq, target_freq, decimation, window)
+
+    return cached(key, lambda: ZoomPlan(num_samples, sample_rate, center_freq, target_freq, decimation, window))
+
+# Function to find how far apart Welch segments of num_samples start when adjacent segments share the fraction overlap
+def welch_step(num_samples, overlap):
+
+    if not 0 <= overlap < 1:
+        raise ValueError("Overlap must be at least 0 and less than 1: %s" % overlap)
+
+    return max(1, int(round(num_samples * (1 - overlap))))
+
+# Function to view samples as segments of num_samples starting every step samples, one row per segment, without copying them
+def welch_segments(samples, num_samples, step):
+
+    return numpy.lib.stride_tricks.sliding_window_view(samples, num_samples)[::step]
+
+# Function to convert interleaved 8 bit I/Q bytes in to a complex buffer in the same way as read_samples()
+def bytes_to_iq(raw, iq):
+
+    raw = numpy.frombuffer(raw, dtype=numpy.uint8, count=2 * len(iq))
+
+    iq.real = raw[0::2]
+    iq.imag = raw[1::2]
+    iq /= 127.5
+    iq -= (1 + 1j)
+
+    return iq
+
+# Function to find the maximum of values[lo:hi] for every pair of lo and hi, hi must be greater than lo
+def range_max(values, lo, hi):
+
+    # table of maxima over runs of 1, 2, 4, ... values
+    table = [values]
+    span = 1
+    while span * 2 <= numpy.max(hi - lo):
+        table.append(numpy.maximum(table[-1][:-span], table[-1][span:]))
+        span = span * 2
+
+    # all levels in one flat array, each level starts a whole row after the last
+    padded = numpy.full(len(table) * len(values), -numpy.inf)
+    for level, row in enumerate(table):
+        padded[level * len(values):level * len(values) + len(row)] = row
+
+    # largest power of two that fits in each range, two overlapping runs of it cover the range
+    level = numpy.frexp(hi - lo)[1] - 1
+    start = level * len(values)
+
+    return numpy.maximum(padded[start + lo], padded[start + hi - 2**level])
+
+# Function to find peaks in each row of a set of spectra, equivalent to peakutils.peak.indexes for non-flat data
+def find_peaks(spectra, thres=0.2, min_dist=50):
+
+    spectra = numpy.atleast_2d(spectra)
+
+    # threshold relative to the range of each spectrum
+    low = numpy.min(spectra, axis=1, keepdims=True)
+    high = numpy.max(spectra, axis=1, keepdims=True)
+    thres = thres * (high - low) + low
+
+    # bins that are higher than both neighbours and above the threshold
+    peaks = local_max(spectra) & (spectra > thres)
+
+    return min_dist_filter(spectra, peaks, min_dist)
+
+# Function to mark bins that are higher than both neighbours
+def local_max(spectra):
+
+    dy = numpy.diff(spectra, axis=1)
+    peaks = numpy.zeros(spectra.shape, dtype=bool)
+    peaks[:, 1:-1] = (dy[:, :-1] > 0) & (dy[:, 1:] < 0)
+
+    return peaks
+
+# Function to keep the highest peaks first and drop any lower peak within min_dist of a kept one
+def min_dist_filter(spectra, peaks, min_dist):
+
+    num_bins = spectra.shape[1]
+
+    if min_dist <= 1:
+        return peaks
+
+    # list every candidate in order, rows are spaced so candidates in different rows never interact
+    rows, cols = numpy.nonzero(peaks)
+    position = rows * (num_bins + min_dist) + cols
+    height = spectra[rows, cols]
+
+    keep = numpy.zeros(len(position), dtype=bool)
+    remaining = numpy.arange(len(position))
+
+    while len(remaining):
+
+        curr_position = position[remaining]
+        curr_height = height[remaining]
+
+        # a candidate that is the highest of the remaining candidates within min_dist is always kept
+        lo = numpy.searchsorted(curr_position, curr_position - min_dist, 'left')
+        hi = numpy.searchsorted(curr_position, curr_position + min_dist, 'right')
+        highest = curr_height >= range_max(curr_height, lo, hi)
+        keep[remaining[highest]] = True
+
+        # find the nearest kept peak either side of each remaining candidate
+        left = numpy.maximum.accumulate(numpy.where(highest, curr_position, -numpy.inf))
+        right = numpy.minimum.accumulate(numpy.where(highest, curr_position, numpy.inf)[::-1])[::-1]
+        near = ((curr_position - left) <= min_dist) | ((right - curr_position) <= min_dist)
+
+        remaining = remaining[~near]
+
+    peaks = peaks.copy()
+    peaks[rows[~keep], cols[~keep]] = False
+
+    return peaks
+
+# Function to run a CFAR detector over a set of spectra in dB, returns the detected bins and the local noise floor of every bin in dB
+# method 'ca' averages the training cells, 'os' takes the rank quantile of them and is robust to nearby carriers but slower
+def cfar(spectra, guard=4, train=32, scale_db=6.0, method='ca', rank=0.75):
+
+    spectra = numpy.atleast_2d(spectra)
+    num_bins = spectra.shape[1]
+
+    # CFAR works on linear power
+    power = 10 ** (spectra / 10)
+
+    if method == 'ca':
+        # cell averaging, sums of the outer window minus the guard window from one cumulative sum
+        bins = numpy.arange(num_bins)
+        outer_lo = numpy.clip(bins - guard - train, 0, num_bins)
+        outer_hi = numpy.clip(bins + guard + train + 1, 0, num_bins)
+        inner_lo = numpy.clip(bins - guard, 0, num_bins)
+        inner_hi = numpy.clip(bins + guard + 1, 0, num_bins)
+
+        cumulative = numpy.zeros((spectra.shape[0], num_bins + 1))
+        numpy.cumsum(power, axis=1, out=cumulative[:, 1:])
+
+        # fewer training cells are available at the ends of the spectrum
+        count = (outer_hi - outer_lo) - (inner_hi - inner_lo)
+        outer = cumulative[:, outer_hi] - cumulative[:, outer_lo]
+        inner = cumulative[:, inner_hi] - cumulative[:, inner_lo]
+        noise = (outer - inner) / count
+
+    elif method == 'os':
+        # ordered statistic, reflect the ends so every bin has a full set of training cells
+        half = guard + train
+        k = int(rank * (2 * train - 1))
+        noise = numpy.zeros(power.shape)
+
+        # one row at a time to keep the windowed view small
+        for row in range(power.shape[0]):
+            padded = numpy.pad(power[row], half, mode='reflect')
+            windows = numpy.lib.stride_tricks.sliding_window_view(padded, 2 * half + 1)
+            cells = numpy.concatenate((windows[:, :train], windows[:, -train:]), axis=1)
+            noise[row] = numpy.partition(cells, k, axis=1)[:, k]
+
+    else:
+        raise ValueError("Unknown CFAR method: %s" % method)
+
+    noise_db = 10 * numpy.log10(noise)
+    detections = spectra > (noise_db + scale_db)
+
+    return detections, noise_db
+
+# Function to detect peaks in a batch of spectra sharing one frequency axis
+# returns amplitudes of peaks 1-4 and noise (one row of 5 per spectrum), frequencies of peaks 1-4 and the detected peak indexes
+# detector 'threshold' uses a threshold relative to the spectrum range, 'cfar_ca' and 'cfar_os' use the local noise floor of cell averaging
+# or ordered statistic cfar(), 'cfar' is 'cfar_ca', cfar_settings are passed on to cfar(), e.g. {'guard': 4, 'train': 32, 'scale_db': 6.0, 'rank': 0.75}
+def peak_det_batch(spectra, faxis, freq_mhz, detector='threshold', cfar_settings=None):
+
+    spectra = numpy.real(numpy.atleast_2d(spectra))
+    faxis = numpy.asarray(faxis)
+
+    num_spectra, num_bins = spectra.shape
+    rows = numpy.arange(num_spectra)
+
+    if detector == 'threshold':
+        # Find peaks in the data using a peak detector (good for more that 1 peak, min_dist needs work)
+        peaks = find_peaks(spectra, thres=0.2, min_dist=50)
+
+    elif detector in ('cfar', 'cfar_ca', 'cfar_os'):
+        settings = dict(cfar_settings or {})
+        settings['method'] = 'os' if detector == 'cfar_os' else 'ca'
+
+        # one peak per detected carrier, the highest bin of each
+        detections, noise_floor = cfar(spectra, **settings)
+        peaks = min_dist_filter(spectra, local_max(spectra) & detections, 50)
+
+    else:
+        raise ValueError("Unknown detector: %s" % detector)
+
+    num_peaks = peaks.sum(axis=1)
+
+    # search for peak at frequency closest to frequency of interest
+    distance = numpy.where(peaks, numpy.abs(faxis - freq_mhz), numpy.inf)
+    min_index = numpy.argmin(distance, axis=1)
+
+    # check peak is close enough to the frequency of interest
+    close = (num_peaks > 0) & ((freq_mhz-0.05) < faxis[min_index]) & (faxis[min_index] < (freq_mhz+0.05))
+
+    # if peak detected isn't close enough use the bin closest to the frequency of interest
+    min_index_freq = numpy.argmin(numpy.abs(faxis - freq_mhz))
+    peak_1_index = numpy.where(close, min_index, min_index_freq)
+
+    if detector != 'threshold':
+        # local noise floor at the measured bin
+        noise = noise_floor[rows, peak_1_index]
+
+    else:
+        # take an average of the bins excluding peaks to estimate noise
+        peak_sum = numpy.where(peaks, spectra, 0).sum(axis=1)
+        noise = (spectra.sum(axis=1) - peak_sum) / (num_bins - num_peaks)
+
+    # find the 3 largest detected peaks and order them from large to small
+    heights = numpy.where(peaks, spectra, -numpy.inf)
+    order = numpy.argpartition(-heights, 2, axis=1)[:, :3]
+    order = numpy.take_along_axis(order, numpy.argsort(-heights[rows[:, None], order], axis=1), axis=1)
+
+    amps = numpy.zeros((num_spectra, 5))
+    freqs = numpy.zeros((num_spectra, 4))
+
+    amps[:, 0] = spectra[rows, peak_1_index]
+    freqs[:, 0] = faxis[peak_1_index]
+
+    # insert dummy data if less than 3 peaks were detected
+    found = numpy.arange(3) < num_peaks[:, None]
+    amps[:, 1:4] = numpy.where(found, spectra[rows[:, None], order], 0)
+    freqs[:, 1:4] = numpy.where(found, faxis[order], 0)
+
+    # Save noise measurement
+    amps[:, 4] = noise
+
+    # split the detected peak indexes in to one array per spectrum
+    indexes = numpy.split(numpy.nonzero(peaks)[1], numpy.cumsum(num_peaks)[:-1])
+
+    return amps, freqs, indexes
+
+# Function to detect peaks in the data
+def peak_det(spectrum, faxis, freq_mhz, detector='threshold', cfar_settings=None):
+
+    amps, freqs, indexes = peak_det_batch(spectrum, faxis, freq_mhz, detector, cfar_settings)
+
+    return amps[0, 0], freqs[0, 0], amps[0, 1], freqs[0, 1], amps[0, 2], freqs[0, 2], amps[0, 3], freqs[0, 3], amps[0, 4], 'noise', indexes[0]
+
+# Function to put the strongest detected peak in place of peak 1, for spectra with no frequency of interest such as sweeps
+# spectra with no detected peak take their highest bin, amps and freqs from peak_det_batch() are changed in place
+def strongest_first(spectra, faxis, amps, freqs):
+
+    spectra = numpy.real(numpy.atleast_2d(spectra))
+
+    # peak 2 is the strongest detected peak, its frequency is 0 if none was detected
+    found = freqs[:, 1] != 0
+    highest = numpy.argmax(spectra, axis=1)
+
+    amps[:, 0] = numpy.where(found, amps[:, 1], spectra[numpy.arange(len(spectra)), highest])
+    freqs[:, 0] = numpy.where(found, freqs[:, 1], numpy.asarray(faxis)[highest])
+
+    return amps, freqs
+
+# Function to find the tuned centre frequencies of a sweep from start_freq to stop_freq in Hz
+# adjacent hops share overlap of the sample rate and edge of the sample rate is dropped at each side of every hop
+# centres are spread evenly over the range and placed on the FFT bin grid so the hops line up bin for bin
+def sweep_centers(start_freq, stop_freq, sample_rate, num_samples, overlap=0.25, edge=0.1):
+
+    fstep = sample_rate / num_samples
+    kept = sample_rate * (1 - 2 * edge)
+    step = sample_rate * (1 - overlap)
+
+    # fewest hops whose kept bands reach from one end of the range to the other
+    num_hops = int(numpy.ceil(max(stop_freq - start_freq - kept, 0) / step)) + 1
+
+    if num_hops == 1:
+        centers = numpy.array([(start_freq + stop_freq) / 2])
+    else:
+        centers = numpy.linspace(start_freq + kept / 2, stop_freq - kept / 2, num_hops)
+
+    return start_freq + numpy.round((centers - start_freq) / fstep) * fstep
+
+# Function to stitch the spectra of a sweep, one fftshifted dB spectrum per centre, in to one spectrum from start_freq to stop_freq
+# the band edges and dc_bins either side of the DC spike are dropped, bins covered by more than one hop are averaged in power
+# and bins no hop covers, such as the DC spike of a hop with no neighbour over it, are interpolated
+# returns the spectrum and its frequency axis in MHz
+def stitch(spectra, centers, sample_rate, start_freq, stop_freq, edge=0.1, dc_bins=2):
+
+    spectra = numpy.atleast_2d(spectra)
+    num_samples = spectra.shape[1]
+    fstep = sample_rate / num_samples
+
+    # bins of each hop that are kept, counted from the centre
+    offsets = numpy.arange(num_samples) - num_samples // 2
+    kept = (numpy.abs(offsets) * fstep <= sample_rate * (0.5 - edge)) & (numpy.abs(offsets) > dc_bins)
+
+    num_bins = int(numpy.ceil((stop_freq - start_freq) / fstep))
+
+    # bin of the stitched spectrum for every kept bin of every hop
+    first = numpy.round((numpy.asarray(centers) - start_freq) / fstep).astype(int)
+    positions = first[:, None] + offsets[kept][None, :]
+    inside = (positions >= 0) & (positions < num_bins)
+
+    power = 10**(spectra[:, kept][inside] / 10)
+    total = numpy.bincount(positions[inside], weights=power, minlength=num_bins)
+    count = numpy.bincount(positions[inside], minlength=num_bins)
+
+    covered = count > 0
+    spectrum = numpy.zeros(num_bins)
+    spectrum[covered] = 10 * numpy.log10(total[covered] / count[covered])
+
+    bins = numpy.arange(num_bins)
+    if not covered.all() and covered.any():
+        spectrum[~covered] = numpy.interp(bins[~covered], bins[covered], spectrum[covered])
+
+    # axis in the same form as a plan's, starting at start_freq
+    faxis = get_plan(num_bins, num_bins * fstep, start_freq + num_bins * fstep / 2, None).faxis
+
+    return spectrum, faxis
@@ -0,0 +1,111 @@
+'''
+Timing of each stage of the capture cycle, kept as histograms and exported in the Prometheus text format
+'''
+
+import bisect
+import contextlib
+import os
+import threading
+import time
+
+# upper bounds of the histogram buckets in seconds
+buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Class collecting how long each named stage takes
+class StageTimer:
+
+    def __init__(self, path='metrics.prom', export_seconds=60):
+
+        self.path = path
+        self.export_seconds = export_seconds
+
+        # per stage: count of each bucket with one extra for anything slower, total time, number of timings and slowest
+        self.histograms = dict()
+
+        # timings come from the capture thread and the stream reader thread
+        self.lock = threading.Lock()
+
+        self.last_export = time.time()
+
+    # Function to time the code inside a with statement as one run of a stage
+    @contextlib.contextmanager
+    def time(self, stage):
+
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    # Function to add one timing of a stage
+    def observe(self, stage, seconds):
+
+        with self.lock:
+            histogram = self.histograms.get(stage)
+
+            if histogram is None:
+                histogram = [[0] * (len(buckets) + 1), 0.0, 0, 0.0]
+                self.histograms[stage] = histogram
+
+            histogram[0][bisect.bisect_left(buckets, seconds)] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+            histogram[3] = max(histogram[3], seconds)
+
+        return
+
+    # Function to export and print the timings once the export period has passed, called once per cycle
+    def report(self):
+
+        if time.time() - self.last_export < self.export_seconds:
+            return
+
+        self.export()
+        print(self.summary())
+
+        return
+
+    # Function to write the histograms to the metrics file
+    def export(self):
+
+        with self.lock:
+            histograms = [(stage, list(counts), total, count) for stage, (counts, total, count, slowest) in sorted(self.histograms.items())]
+
+        lines = ['# HELP sdr_stage_seconds Time spent in each stage of the capture cycle',
+                 '# TYPE sdr_stage_seconds histogram']
+
+        for stage, counts, total, count in histograms:
+            cumulative = 0
+            for bound, bucket_count in zip(buckets, counts):
+                cumulative += bucket_count
+                lines.append('sdr_stage_seconds_bucket{stage="%s",le="%g"} %d' % (stage, bound, cumulative))
+
+            lines.append('sdr_stage_seconds_bucket{stage="%s",le="+Inf"} %d' % (stage, count))
+            lines.append('sdr_stage_seconds_sum{stage="%s"} %.6f' % (stage, total))
+            lines.append('sdr_stage_seconds_count{stage="%s"} %d' % (stage, count))
+
+        # replace the file in one step so a reader never sees it half written
+        try:
+            with open(self.path + '.tmp', 'w') as f:
+                f.write('\n'.join(lines) + '\n')
+
+            os.replace(self.path + '.tmp', self.path)
+
+        except OSError:
+            print('Metrics Not Saved\n')
+
+        self.last_export = time.time()
+
+        return
+
+    # Function to describe the mean and slowest time of every stage in one line
+    def summary(self):
+
+        with self.lock:
+            parts = ['%s %.1f/%.1f' % (stage, 1000 * total / count, 1000 * slowest) for stage, (counts, total, count, slowest) in sorted(self.histograms.items())]
+
+        return 'Stage Times (mean/max ms): %s\n' % ', '.join(parts)
+
+# timer shared by every part of the capture cycle
+stages = StageTimer()
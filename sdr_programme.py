@@ -0,0 +1,23 @@
+'''
+Loading of the main capture programme as a module, for the scripts that reuse its capture and processing functions
+'''
+
+import contextlib
+import importlib.util
+import io
+import os
+
+# main programme, loaded without starting its loop
+programme_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rpi_sdr_2freq (2).py')
+
+# Function to load the main programme as a module
+def load_programme(path=programme_path):
+
+    spec = importlib.util.spec_from_file_location('rpi_sdr_2freq', path)
+    programme = importlib.util.module_from_spec(spec)
+
+    # keep the programme's start up messages out of the results
+    with contextlib.redirect_stdout(io.StringIO()):
+        spec.loader.exec_module(programme)
+
+    return programme
@@ -0,0 +1,193 @@
+'''
+Buffered, append only logging of measurement results
+'''
+
+import csv
+import io
+import os
+import struct
+import time
+import zlib
+import numpy
+
+# Class writing results in the readable .TXT format
+class TextSink:
+
+    def __init__(self, path='log.txt'):
+
+        self.path = path
+
+    # Function to format one result as a line of text
+    def encode(self, row):
+
+        return ('%s %s Peaks: %.2f dB at %.3f MHz, %.2f dB at %.3f MHz, %.2f dB at %.3f MHz, %.2f dB at %.3f MHz and %.2f dB for %s Location: Longitude %.3f, Latitude %.3f, Altitude %.3fm\n' % tuple(row)).encode()
+
+    # Function to remove a partly written last line left by a power loss
+    def repair(self):
+
+        truncate_after(self.path, b'\n')
+
+        return
+
+# Class writing results as rows of the .CSV file
+class CsvSink(TextSink):
+
+    def __init__(self, path='log.csv'):
+
+        self.path = path
+
+    # Function to format one result as a .CSV row
+    def encode(self, row):
+
+        line = io.StringIO()
+        writer = csv.writer(line, delimiter=',', quotechar='|', quoting=csv.QUOTE_MINIMAL, lineterminator = '\n')
+        writer.writerow(row)
+
+        return line.getvalue().encode()
+
+# layout of one binary result: time, 5 amplitudes, 4 peak frequencies, longitude, latitude and altitude, followed by a CRC of these
+payload_format = struct.Struct('<d5f4f2df')
+
+record_dtype = numpy.dtype([('time', '<f8'), ('amp', '<f4', 5), ('freq', '<f4', 4), ('lon', '<f8'), ('lat', '<f8'), ('alt', '<f4'), ('crc', '<u4')])
+
+# Class writing results as fixed size binary records, 68 bytes each
+class BinarySink:
+
+    def __init__(self, path='log.bin'):
+
+        self.path = path
+
+    # Function to pack one result in to a record
+    def encode(self, row):
+
+        current_date, current_hour = row[0], row[1]
+        timestamp = time.mktime(time.strptime('%s %s' % (current_date, current_hour), '%d/%m/%y %H:%M:%S'))
+
+        payload = payload_format.pack(timestamp, *(list(row[2:11:2]) + list(row[3:10:2]) + list(row[12:15])))
+
+        return payload + struct.pack('<I', zlib.crc32(payload))
+
+    # Function to remove a partly written last record left by a power loss
+    def repair(self):
+
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return
+
+        if size % record_dtype.itemsize:
+            with open(self.path, 'r+b') as f:
+                f.truncate(size - size % record_dtype.itemsize)
+
+        return
+
+# Function to read every complete record with a valid CRC from a binary log
+def read_records(path):
+
+    records = numpy.fromfile(path, dtype=record_dtype, count=os.path.getsize(path) // record_dtype.itemsize)
+
+    raw = records.view(numpy.uint8).reshape(len(records), record_dtype.itemsize)
+    valid = numpy.array([zlib.crc32(line[:-4].tobytes()) for line in raw], dtype=numpy.uint32) == records['crc']
+
+    return records[valid]
+
+# Function to cut a file back to just after the last separator, used to drop a torn last line
+def truncate_after(path, separator):
+
+    try:
+        with open(path, 'r+b') as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+
+            if size == 0:
+                return
+
+            # only the last few kB need searching
+            start = max(0, size - 65536)
+            f.seek(start)
+            tail = f.read()
+
+            if tail.endswith(separator):
+                return
+
+            end = tail.rfind(separator)
+            f.truncate(start + end + 1 if end >= 0 else start)
+
+    except OSError:
+        pass
+
+    return
+
+# Class holding the log files open and writing results in large blocks
+class ResultWriter:
+
+    def __init__(self, sinks, flush_bytes=65536, flush_seconds=60, checkpoint_seconds=600):
+
+        self.sinks = sinks
+        self.flush_bytes = flush_bytes
+        self.flush_seconds = flush_seconds
+        self.checkpoint_seconds = checkpoint_seconds
+
+        # records waiting to be written, one buffer per sink
+        self.buffers = [bytearray() for sink in sinks]
+        self.files = []
+
+        for sink in sinks:
+            # clear any damage from a power loss before appending
+            sink.repair()
+            self.files.append(open(sink.path, 'ab', buffering=0))
+
+        self.last_flush = time.time()
+        self.last_checkpoint = time.time()
+
+    # Function to add one result, written out once the size or time limit is reached
+    def write(self, row):
+
+        for sink, buffer in zip(self.sinks, self.buffers):
+            buffer += sink.encode(row)
+
+        now = time.time()
+
+        if now - self.last_checkpoint >= self.checkpoint_seconds:
+            self.checkpoint()
+
+        elif max(len(buffer) for buffer in self.buffers) >= self.flush_bytes or now - self.last_flush >= self.flush_seconds:
+            self.flush()
+
+        return
+
+    # Function to write buffered results, whole records only so earlier records are never touched
+    def flush(self):
+
+        for f, buffer in zip(self.files, self.buffers):
+            if buffer:
+                f.write(buffer)
+                del buffer[:]
+
+        self.last_flush = time.time()
+
+        return
+
+    # Function to write buffered results and force them on to the card
+    def checkpoint(self):
+
+        self.flush()
+
+        for f in self.files:
+            os.fsync(f.fileno())
+
+        self.last_checkpoint = time.time()
+
+        return
+
+    # Function to write everything and close the files
+    def close(self):
+
+        self.checkpoint()
+
+        for f in self.files:
+            f.close()
+
+        self.files = []
+
+        return
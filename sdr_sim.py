@@ -0,0 +1,185 @@
+'''
+Simulated and recorded stand-ins for the RTL SDR so the programme and its DSP can be run and timed without a dongle
+'''
+
+import json
+import os
+import time
+import numpy
+from sdr_dsp import bytes_to_iq
+
+# carriers used when none are given: frequency in Hz, power in dB relative to full scale and drift in Hz per second
+default_carriers = [
+    (71.0e6, -15, 0),
+    (70.95e6, -30, 2),
+    (71.06e6, -40, -5),
+    (869.525e6, -20, 0),
+    (869.5e6, -35, 10),
+    (869.61e6, -45, 0),
+]
+
+# Class standing in for rtlsdr.RtlSdr, producing 8 bit I/Q of tones and drifting carriers in noise
+class SimulatedRtlSdr:
+
+    def __init__(self, carriers=None, noise_db=-30, realtime=False, repeat=0, seed=None, device_index=0, serial_number=None):
+
+        # settings read and written by the programme in the same way as on the real device
+        self.sample_rate = 2.048e6
+        self.center_freq = 100e6
+        self.gain = 0
+
+        # device the programme asked for, every simulated device receives the same carriers
+        self.device_index = device_index
+        self.serial_number = serial_number
+
+        self.carriers = list(default_carriers if carriers is None else carriers)
+        self.noise_db = noise_db
+
+        # deliver samples no faster than the sample rate, as the dongle does
+        self.realtime = realtime
+
+        # if set, this many samples are made once per tuning and then read over and over, to time the DSP alone
+        self.repeat = repeat
+        self.cache = None
+        self.cache_key = None
+        self.cache_position = 0
+
+        self.random = numpy.random.RandomState(seed)
+
+        # samples made since the device was opened, keeps carriers continuous from one read to the next
+        self.position = 0
+        self.next_read = time.time()
+
+    # Function to read interleaved 8 bit I/Q bytes, as RtlSdr.read_bytes()
+    def read_bytes(self, num_bytes):
+
+        num_samples = num_bytes // 2
+
+        if self.realtime:
+            self.next_read = max(self.next_read, time.time()) + num_samples / self.sample_rate
+            remaining = self.next_read - time.time()
+            if remaining > 0:
+                time.sleep(remaining)
+
+        if self.repeat:
+            raw = self.cached(num_samples)
+        else:
+            raw = self.generate(num_samples)
+
+        return bytearray(raw.tobytes())
+
+    # Function to read complex samples, as RtlSdr.read_samples()
+    def read_samples(self, num_samples):
+
+        raw = self.read_bytes(2 * num_samples)
+
+        # convert bytes to samples in the same way as the real device
+        return bytes_to_iq(raw, numpy.zeros(num_samples, dtype=numpy.complex128))
+
+    # Function to release the device, nothing to do here
+    def close(self):
+
+        return
+
+    # Function to make the next samples as 8 bit I/Q bytes
+    def generate(self, num_samples):
+
+        t = (self.position + numpy.arange(num_samples)) / self.sample_rate
+        self.position += num_samples
+
+        # noise power is split between I and Q
+        sigma = numpy.sqrt(10**(self.noise_db / 10) / 2)
+        samples = sigma * (self.random.standard_normal(num_samples) + 1j * self.random.standard_normal(num_samples))
+
+        for freq, power_db, drift in self.carriers:
+
+            # only carriers inside the tuned bandwidth are received
+            offset = freq - self.center_freq
+            if abs(offset) >= self.sample_rate / 2:
+                continue
+
+            # frequency offset plus a linear drift gives a quadratic phase
+            phase = 2 * numpy.pi * (offset * t + 0.5 * drift * t**2)
+            samples += 10**(power_db / 20) * numpy.exp(1j * phase)
+
+        # quantise to unsigned bytes as the dongle does
+        raw = numpy.empty(2 * num_samples, dtype=numpy.uint8)
+        raw[0::2] = numpy.clip(numpy.round((samples.real + 1) * 127.5), 0, 255)
+        raw[1::2] = numpy.clip(numpy.round((samples.imag + 1) * 127.5), 0, 255)
+
+        return raw
+
+    # Function to read the next samples from a block made once for the current tuning
+    def cached(self, num_samples):
+
+        key = (self.center_freq, self.sample_rate)
+
+        if self.cache_key != key:
+            self.cache = self.generate(self.repeat)
+            self.cache_key = key
+            self.cache_position = 0
+
+        raw = numpy.empty(2 * num_samples, dtype=numpy.uint8)
+
+        # copy whole runs of the block, wrapping round to its start
+        filled = 0
+        while filled < len(raw):
+            start = 2 * self.cache_position
+            count = min(len(self.cache) - start, len(raw) - filled)
+            raw[filled:filled + count] = self.cache[start:start + count]
+            filled += count
+            self.cache_position = (self.cache_position + count // 2) % self.repeat
+
+        return raw
+
+# Class standing in for rtlsdr.RtlSdr that plays back a raw I/Q recording as fast as it is read
+class RecordedRtlSdr:
+
+    def __init__(self, name):
+
+        with open(name + '.sigmf-meta', 'r') as f:
+            self.meta = json.load(f)
+
+        capture = self.meta['captures'][0]
+
+        # tuning the recording was made with
+        self.sample_rate = self.meta['global']['core:sample_rate']
+        self.center_freq = capture['core:frequency']
+        self.gain = capture.get('rtlsdr:gain', 0)
+
+        self.name = name
+
+        # map the file rather than reading it so long recordings are not held in memory
+        if os.path.getsize(name + '.sigmf-data'):
+            self.raw = numpy.memmap(name + '.sigmf-data', dtype=numpy.uint8, mode='r')
+        else:
+            self.raw = numpy.zeros(0, dtype=numpy.uint8)
+
+        self.num_samples = len(self.raw) // 2
+        self.position = 0
+
+    # Function to read the next interleaved 8 bit I/Q bytes of the recording, as RtlSdr.read_bytes()
+    def read_bytes(self, num_bytes):
+
+        if self.position + num_bytes > len(self.raw):
+            raise IOError('End of recording %s' % self.name)
+
+        raw = self.raw[self.position:self.position + num_bytes]
+        self.position += num_bytes
+
+        return raw
+
+    # Function to read the next complex samples of the recording, as RtlSdr.read_samples()
+    def read_samples(self, num_samples):
+
+        raw = self.read_bytes(2 * num_samples)
+
+        # convert bytes to samples in the same way as the real device
+        return bytes_to_iq(raw, numpy.zeros(num_samples, dtype=numpy.complex128))
+
+    # Function to release the recording
+    def close(self):
+
+        self.raw = numpy.zeros(0, dtype=numpy.uint8)
+
+        return
@@ -0,0 +1,354 @@
+'''
+Storage of captured data: raw I/Q recordings with their metadata, archives of spectra and an index of both
+'''
+
+import json
+import os
+import sqlite3
+import time
+import numpy
+from sdr_dsp import bytes_to_iq
+
+# Class writing the dongle's raw interleaved 8 bit I/Q bytes to a .sigmf-data file with a .sigmf-meta sidecar
+class IqRecorder:
+
+    # settings are the capture settings needed to process the recording again, kept in the metadata as rpi_sdr: fields
+    def __init__(self, name, center_freq, sample_rate, gain, lon, lat, alt, start_time=None, settings=None):
+
+        if start_time is None:
+            start_time = time.time()
+
+        self.name = name
+        self.num_bytes = 0
+        self.meta = None
+
+        # metadata is written first so a recording cut short by power loss can still be read
+        meta = {
+            'global': {
+                'core:datatype': 'cu8',
+                'core:sample_rate': sample_rate,
+                'core:version': '1.0.0',
+                'core:hw': 'RTL-SDR',
+                'core:recorder': 'Raspberry-Pi-SDR',
+                'core:geolocation': {'type': 'Point', 'coordinates': [lon, lat, alt]},
+            },
+            'captures': [{
+                'core:sample_start': 0,
+                'core:frequency': center_freq,
+                'core:datetime': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(start_time)) + '.%03dZ' % (int(start_time * 1000) % 1000),
+                'rtlsdr:gain': gain,
+            }],
+            'annotations': [],
+        }
+
+        if settings is not None:
+            for key in settings:
+                meta['captures'][0]['rpi_sdr:' + key] = settings[key]
+
+        self.meta = meta
+        self.write_meta()
+
+        self.file = open(name + '.sigmf-data', 'wb')
+
+    # Function to write the metadata file
+    def write_meta(self):
+
+        with open(self.name + '.sigmf-meta', 'w') as f:
+            json.dump(self.meta, f, indent=2)
+
+        return
+
+    # Function to append raw bytes exactly as read from the device
+    def write(self, raw):
+
+        self.file.write(raw)
+        self.num_bytes += len(raw)
+
+        return
+
+    # Function to finish the recording, settings only known once the capture is done are added to the metadata
+    def close(self, settings=None):
+
+        self.file.close()
+
+        if settings is not None:
+            for key in settings:
+                self.meta['captures'][0]['rpi_sdr:' + key] = settings[key]
+            self.write_meta()
+
+        print('%s.sigmf-data file saved, %d samples\n' % (self.name, self.num_bytes // 2))
+
+        return
+
+    # Function to delete a closed recording, for a capture that read nothing
+    def remove(self):
+
+        os.remove(self.name + '.sigmf-data')
+        os.remove(self.name + '.sigmf-meta')
+
+        print('%s removed, no samples recorded\n' % self.name)
+
+        return
+
+# Function to load a recording, returns the complex samples and the metadata
+def read_iq(name, start=0, count=None):
+
+    with open(name + '.sigmf-meta', 'r') as f:
+        meta = json.load(f)
+
+    # map the file rather than reading it so long recordings can be sliced cheaply
+    raw = numpy.memmap(name + '.sigmf-data', dtype=numpy.uint8, mode='r')
+
+    if count is None:
+        count = len(raw) // 2 - start
+
+    raw = raw[2 * start:2 * (start + count)]
+
+    # convert bytes to samples in the same way as read_samples()
+    samples = bytes_to_iq(raw, numpy.zeros(count, dtype=numpy.complex64))
+
+    return samples, meta
+
+# Function to list the recordings in a directory
+def list_recordings(directory='.'):
+
+    names = []
+
+    for file_name in sorted(os.listdir(directory)):
+        if file_name.endswith('.sigmf-meta'):
+            names.append(os.path.join(directory, file_name[:-len('.sigmf-meta')]))
+
+    return names
+
+# layout of one archive index entry, one per stored spectrum
+index_dtype = numpy.dtype([('time', '<f8'), ('center_freq', '<f8'), ('sample_rate', '<f8')])
+
+# Class appending fixed width spectra to one file with a companion index of times and frequencies
+class SpectrumArchive:
+
+    def __init__(self, name, num_bins, dtype='<f4'):
+
+        self.name = name
+        self.num_bins = num_bins
+        self.dtype = numpy.dtype(dtype)
+
+        header_name = name + '.json'
+
+        if os.path.exists(header_name):
+            with open(header_name, 'r') as f:
+                header = json.load(f)
+
+            if header['num_bins'] != num_bins:
+                raise ValueError("%s holds spectra of %d bins, not %d" % (name, header['num_bins'], num_bins))
+
+            self.dtype = numpy.dtype(header['dtype'])
+
+        else:
+            with open(header_name, 'w') as f:
+                json.dump({'num_bins': num_bins, 'dtype': self.dtype.str}, f)
+
+        # drop any row only partly written before a power loss
+        self.count = archive_length(name, num_bins, self.dtype)
+        for file_name, row_size in [(name + '.spectra', num_bins * self.dtype.itemsize), (name + '.index', index_dtype.itemsize)]:
+            with open(file_name, 'ab') as f:
+                f.truncate(self.count * row_size)
+
+        self.data = open(name + '.spectra', 'ab', buffering=0)
+        self.index = open(name + '.index', 'ab', buffering=0)
+
+    # Function to add one spectrum, the spectrum is written before its index entry so the index never points past the data
+    # a spectrum of any other width would shift every later row, so it is refused before anything is written
+    def append(self, spectrum, timestamp, center_freq, sample_rate):
+
+        spectrum = numpy.asarray(spectrum, dtype=self.dtype)
+
+        if spectrum.shape != (self.num_bins,):
+            raise ValueError("%s holds spectra of %d bins, not %s" % (self.name, self.num_bins, 'x'.join(str(size) for size in spectrum.shape)))
+
+        self.data.write(spectrum.tobytes())
+
+        entry = numpy.array([(timestamp, center_freq, sample_rate)], dtype=index_dtype)
+        self.index.write(entry.tobytes())
+
+        self.count += 1
+
+        return self.count - 1
+
+    # Function to close the files
+    def close(self):
+
+        self.data.close()
+        self.index.close()
+
+        return
+
+# Function to find how many complete rows an archive holds
+def archive_length(name, num_bins, dtype):
+
+    sizes = []
+    for file_name, row_size in [(name + '.spectra', num_bins * dtype.itemsize), (name + '.index', index_dtype.itemsize)]:
+        try:
+            sizes.append(os.path.getsize(file_name) // row_size)
+        except OSError:
+            sizes.append(0)
+
+    return min(sizes)
+
+# Function to open an archive without reading it, returns the spectra as an (n, num_bins) memory map and the index
+def open_archive(name):
+
+    with open(name + '.json', 'r') as f:
+        header = json.load(f)
+
+    num_bins = header['num_bins']
+    dtype = numpy.dtype(header['dtype'])
+    count = archive_length(name, num_bins, dtype)
+
+    # memmap cannot map an empty file
+    if count == 0:
+        return numpy.zeros((0, num_bins), dtype=dtype), numpy.zeros(0, dtype=index_dtype)
+
+    spectra = numpy.memmap(name + '.spectra', dtype=dtype, mode='r', shape=(count, num_bins))
+    index = numpy.memmap(name + '.index', dtype=index_dtype, mode='r', shape=(count,))
+
+    return spectra, index
+
+# Function to find the rows between two times, slicing the spectra with the result gives a view without copying
+def time_slice(index, start_time, end_time):
+
+    lo, hi = numpy.searchsorted(index['time'], [start_time, end_time])
+
+    return slice(lo, hi)
+
+# Function to list the archives in a directory
+def list_archives(directory='.'):
+
+    names = []
+
+    for file_name in sorted(os.listdir(directory)):
+        if file_name.endswith('.spectra'):
+            names.append(os.path.join(directory, file_name[:-len('.spectra')]))
+
+    return names
+
+# Class keeping one archive open per band per day and starting new ones at midnight
+class SpectrumStore:
+
+    def __init__(self, directory='.'):
+
+        self.directory = directory
+        self.archives = dict()
+
+    # Function to add a spectrum to the archive for its band and day, returns the archive name and row
+    # spectra of another kind or width for the same band, such as zoomed spectra, are given a label and kept in their own archive
+    def append(self, freq_mhz, spectrum, timestamp, center_freq, sample_rate, label=None):
+
+        day = time.strftime('%y_%m_%d', time.localtime(timestamp))
+
+        if label is None:
+            name = os.path.join(self.directory, '%s-%.1fMHz-spectra' % (day, freq_mhz))
+        else:
+            name = os.path.join(self.directory, '%s-%.1fMHz-%s-spectra' % (day, freq_mhz, label))
+
+        archive = self.archives.get((freq_mhz, label))
+
+        # start a new file for a new day
+        if archive is None or archive.name != name:
+            if archive is not None:
+                archive.close()
+
+            archive = SpectrumArchive(name, len(spectrum))
+            self.archives[(freq_mhz, label)] = archive
+
+        row = archive.append(spectrum, timestamp, center_freq, sample_rate)
+
+        return name, row
+
+    # Function to close every archive
+    def close(self):
+
+        for archive in self.archives.values():
+            archive.close()
+
+        self.archives = dict()
+
+        return
+
+# Class keeping a database that maps each logged measurement to its archived spectrum and raw recording
+class CaptureIndex:
+
+    def __init__(self, path='captures.db'):
+
+        # stored file names are relative to the directory of the database
+        self.directory = os.path.dirname(os.path.abspath(path))
+
+        self.db = sqlite3.connect(path)
+
+        # write ahead logging avoids rewriting the database file on every commit
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+
+        self.db.execute('CREATE TABLE IF NOT EXISTS captures (date TEXT, hour TEXT, freq_mhz REAL, archive TEXT, row INTEGER, iq TEXT, num_avg INTEGER)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS captures_time ON captures (date, hour)')
+
+        # databases made before the number of averages was recorded gain the column, empty for their entries
+        columns = [column[1] for column in self.db.execute('PRAGMA table_info(captures)')]
+        if 'num_avg' not in columns:
+            self.db.execute('ALTER TABLE captures ADD COLUMN num_avg INTEGER')
+
+    # Function to record where the data for one logged measurement is stored, and how many averages it took
+    def add(self, current_date, current_hour, freq_mhz, archive, row, iq=None, num_avg=None):
+
+        if iq is not None:
+            iq = os.path.relpath(os.path.abspath(iq), self.directory)
+
+        self.db.execute('INSERT INTO captures (date, hour, freq_mhz, archive, row, iq, num_avg) VALUES (?, ?, ?, ?, ?, ?, ?)', (current_date, current_hour, freq_mhz, os.path.relpath(os.path.abspath(archive), self.directory), row, iq, num_avg))
+
+        return
+
+    # Function to make the added entries permanent
+    def commit(self):
+
+        self.db.commit()
+
+        return
+
+    # Function to find the stored data for a logged measurement, returns archive name, row and raw recording name or None
+    def find(self, current_date, current_hour, freq_mhz=None):
+
+        found = self.db.execute('SELECT freq_mhz, archive, row, iq FROM captures WHERE date = ? AND hour = ?', (current_date, current_hour)).fetchall()
+
+        if not found:
+            return None
+
+        # both bands may have been logged in the same second, take the band nearest to the given frequency
+        if freq_mhz is not None:
+            found.sort(key=lambda entry: abs(entry[0] - freq_mhz))
+
+        entry_freq, archive, row, iq = found[0]
+
+        if iq is not None:
+            iq = os.path.join(self.directory, iq)
+
+        return os.path.join(self.directory, archive), row, iq
+
+    # Function to list every entry as date, hour, band, archive name, row and raw recording name or None
+    def entries(self):
+
+        found = []
+
+        for current_date, current_hour, freq_mhz, archive, row, iq in self.db.execute('SELECT date, hour, freq_mhz, archive, row, iq FROM captures ORDER BY rowid'):
+            if iq is not None:
+                iq = os.path.join(self.directory, iq)
+
+            found.append((current_date, current_hour, freq_mhz, os.path.join(self.directory, archive), row, iq))
+
+        return found
+
+    # Function to close the database
+    def close(self):
+
+        self.db.commit()
+        self.db.close()
+
+        return